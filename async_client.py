@@ -0,0 +1,55 @@
+import os
+import sys
+import asyncio
+from pathlib import Path
+from postman_async_client import deliver_concurrently, DeliveryError
+from postman_transaction import Transaction
+from utils import read_config, client_log
+
+
+def main():
+    if len(sys.argv) != 2:
+        exit(1)
+    cfg = read_config(sys.argv[1])
+    if "server_port" not in cfg or "send_path" not in cfg:
+        exit(2)
+    send_path = os.path.expanduser(cfg["send_path"])
+    if not cfg["server_port"].isdigit() or not os.path.isdir(send_path):
+        exit(2)
+    server_port = int(cfg["server_port"])
+    concurrency = int(cfg.get("client_concurrency", "100"))
+    transactions = []
+    for file in sorted(os.listdir(send_path)):
+        file_path = Path(send_path) / file
+        try:
+            with open(str(file_path), mode="r", encoding="utf-8") as send_file:
+                txn = Transaction.read_text(send_file.read())
+        except (SyntaxError, ValueError):   # malformed headers or not text at all
+            txn = None
+        if txn is not None and txn.check_formation():
+            transactions.append(txn)
+        else:
+            client_log(str(file_path.absolute()) + ": Bad formation")
+    results = asyncio.run(deliver_concurrently("127.0.0.1", server_port, transactions,
+                                               concurrency))
+    failed = False
+    for result in results:
+        if isinstance(result, DeliveryError):
+            result.pm_client.print_client_log()
+            if isinstance(result.__cause__, ConnectionResetError):
+                client_log("Connection lost")
+            elif isinstance(result.__cause__, ConnectionRefusedError):
+                client_log("Cannot establish connection")
+            else:
+                client_log(f"Delivery failed: {result.__cause__!r}")
+            failed = True
+        elif isinstance(result, Exception):
+            client_log(f"Delivery failed: {result!r}")
+            failed = True
+        else:
+            result.print_client_log()
+    if failed:
+        exit(3)
+
+if __name__ == '__main__':
+    main()
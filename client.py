@@ -2,8 +2,11 @@
 import os
 import sys
 import hmac
+import threading
 from pathlib import Path
 from postman_client import PostmanClient, Transaction
+from postman_journal import DeliveryJournal, DeliveryStatus
+from postman_queue import OutboundQueue, read_priority_rules
 from utils import read_config, client_log, encode_base64_msg
 
 # This is just a sample pair of ID and Secret
@@ -11,6 +14,95 @@ PERSONAL_ID = '7D444D'
 PERSONAL_SECRET = 'b4b52156ba5213240a2315b0bc5412ed'
 
 
+def deliver_file(pm_client: PostmanClient, file_path: Path) -> bool:
+    """Deliver one spool file in a new session of the client.
+
+    Args:
+        pm_client (PostmanClient): A client which is not connected yet
+        file_path (Path): The spool file path
+
+    Raises:
+        ConnectionResetError: Connection reset by the server
+        ConnectionRefusedError: The server cannot be reached
+
+    Returns:
+        bool: True for the email is sent, False for the file is badly formed
+    """
+    try:
+        with open(str(file_path), mode="r", encoding="utf-8") as send_file:
+            txn = Transaction.read_text(send_file.read())
+    except (SyntaxError, ValueError):   # malformed headers or not text at all
+        return False
+    if not txn.check_formation():
+        return False
+    pm_client.connect()
+    pm_client.receive()
+    ehlo_resp = pm_client.run("EHLO", "127.0.0.1")
+    if "auth" in str(file_path) and "CRAM-MD5" in ehlo_resp:
+        pm_client.run("AUTH", "CRAM-MD5")
+        _, server_challenge = pm_client.receive()
+        digester = hmac.new(PERSONAL_SECRET.encode("ascii"), \
+            msg=server_challenge.encode("ascii"), digestmod='md5')
+        to_send = encode_base64_msg(PERSONAL_ID + " " + digester.hexdigest())
+        pm_client.send(to_send)
+        pm_client.receive()
+    pm_client.send_email(txn, chunking="CHUNKING" in ehlo_resp)
+    pm_client.run("QUIT")
+    pm_client.disconnect()
+    return True
+
+
+def deliver_queued(send_path: str, server_port: int, out_queue: OutboundQueue,
+                   journal: DeliveryJournal | None, log_lock: threading.Lock):
+    """Deliver spool files from the queue until nothing is left to deliver.
+
+    Args:
+        send_path (str): The spool directory
+        server_port (int): The port of the server
+        out_queue (OutboundQueue): The outbound queue shared by the workers
+        journal (DeliveryJournal | None): The delivery journal, if any
+        log_lock (threading.Lock): Keeps the session logs of the workers apart
+    """
+    while True:
+        file = out_queue.take()
+        if file is None:
+            break
+        file_path = Path(send_path) / file
+        pm_client = PostmanClient("127.0.0.1", server_port)
+        status = DeliveryStatus.FAILED
+        try:
+            sent = deliver_file(pm_client, file_path)
+            with log_lock:
+                if sent:
+                    pm_client.print_client_log()
+                else:
+                    client_log(str(file_path.absolute()) + ": Bad formation")
+            status = DeliveryStatus.SENT if sent else DeliveryStatus.BAD_FORMATION
+        except (ConnectionResetError, ConnectionRefusedError) as err:
+            with log_lock:
+                pm_client.print_client_log()
+                if isinstance(err, ConnectionResetError):
+                    client_log("Connection lost")
+                else:
+                    client_log("Cannot establish connection")
+        except Exception as err:   # e.g. a broken pipe or a reply the client cannot parse
+            with log_lock:
+                pm_client.print_client_log()
+                client_log(f"Delivery failed: {err!r}")
+        finally:
+            # every file handed out goes back to the queue, or the other workers wait forever
+            try:
+                if hasattr(pm_client, "cli"):
+                    pm_client.disconnect()
+                if journal is not None:
+                    journal.record(file, status)
+            finally:
+                if status == DeliveryStatus.FAILED:
+                    out_queue.defer(file)
+                else:
+                    out_queue.done(file)
+
+
 def main(eaves_mode = False):
     if len(sys.argv) != 2:
         exit(1)
@@ -24,40 +116,55 @@ def main(eaves_mode = False):
         server_port = int(cfg["client_port"])  # eavesdropper testing
     else:
         server_port = int(cfg["server_port"])
-    send_list = sorted(os.listdir(send_path))
-    for file in send_list:
-        pm_client = PostmanClient("127.0.0.1", server_port)
-        file_path = Path(send_path) / file
-        send_file = open(str(file_path), mode="r", encoding="utf-8")
+    journal = None
+    if "journal_path" in cfg:
+        journal = DeliveryJournal(os.path.expanduser(cfg["journal_path"]),
+                                  spool_path=send_path)
+    out_queue = OutboundQueue(float(cfg.get("retry_base_delay", "1")),
+                              float(cfg.get("retry_max_delay", "60")),
+                              int(cfg.get("retry_max_attempts", "5")),
+                              read_priority_rules(cfg.get("queue_priorities", "")))
+    state_path = os.path.expanduser(cfg["queue_path"]) if "queue_path" in cfg else None
+    spool_mtime = os.stat(send_path).st_mtime_ns
+    # an unchanged spool needs no rescan when the queue state was saved
+    if state_path is None or not out_queue.load(state_path, spool_mtime):
+        own_files = {Path(path).resolve() for path in [journal and journal.journal_path,
+                                                       state_path] if path}
+        for file in sorted(os.listdir(send_path)):
+            if (journal is None or not journal.is_completed(file)) \
+            and (Path(send_path) / file).resolve() not in own_files:
+                out_queue.add(file)
+    # only the files which are not delivered yet are worth sending
+    if journal is not None:
+        for file in list(out_queue.entries):
+            if journal.is_completed(file):
+                out_queue.done(file)
+    if state_path is not None:
+        out_queue.save(state_path, spool_mtime)
+    log_lock = threading.Lock()
+    crashed_workers = []
+
+    def run_worker():
         try:
-            txn = Transaction.read_text(send_file.read())
-            if txn.check_formation():
-                pm_client.connect()
-                pm_client.receive()
-                ehlo_resp = pm_client.run("EHLO", "127.0.0.1")
-                if "auth" in str(file_path) and "CRAM-MD5" in ehlo_resp:
-                    pm_client.run("AUTH", "CRAM-MD5")
-                    _, server_challenge = pm_client.receive()
-                    digester = hmac.new(PERSONAL_SECRET.encode("ascii"), \
-                        msg=server_challenge.encode("ascii"), digestmod='md5')
-                    to_send = encode_base64_msg(PERSONAL_ID + " " + digester.hexdigest())
-                    pm_client.send(to_send)
-                    pm_client.receive()
-                pm_client.send_email(txn)
-                pm_client.run("QUIT")
-                pm_client.disconnect()
-                pm_client.print_client_log()
-            else:
-                client_log(str(file_path.absolute()) + ": Bad formation")
-        except ConnectionResetError:
-            pm_client.print_client_log()
-            client_log("Connection lost")
-            exit(3)
-        except ConnectionRefusedError:
-            pm_client.print_client_log()
-            client_log("Cannot establish connection")
-            exit(3)
-        send_file.close()
+            deliver_queued(send_path, server_port, out_queue, journal, log_lock)
+        except BaseException:
+            crashed_workers.append(threading.current_thread().name)
+            raise
+
+    workers = [threading.Thread(target=run_worker)
+               for _ in range(int(cfg.get("client_workers", "1")))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if state_path is not None:
+        out_queue.save(state_path, os.stat(send_path).st_mtime_ns)
+    if journal is not None:
+        journal.close()
+    if len(crashed_workers) > 0:
+        exit(4)
+    if len(out_queue.failed) > 0:
+        exit(3)
 
 if __name__ == '__main__':
     main()
@@ -39,4 +39,12 @@ for tc in e2e_tests/*.in; do
     kill -INT $(pgrep -fl server.py | cut -f1 -d ' ')
 done
 rm server.log
-coverage report --show-missing
\ No newline at end of file
+coverage report --show-missing
+# every entry point must start within its import time budget
+if python3 startup_bench.py
+then
+    echo -e "\033[1mStartup budget passed!\033[0m"
+else
+    echo -e "\033[1mDid not pass startup budget\033[0m"
+    exit 1
+fi
\ No newline at end of file
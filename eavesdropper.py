@@ -1,10 +1,11 @@
 
 import os
 import sys
-import socket
 from postman_client import PostmanClient
 from utils import read_config, client_log, server_log
 from postman_server import PostmanServer
+from postman_capture import CaptureWriter
+from postman_listener import read_listener_config
 
 def main():
     if len(sys.argv) != 2:
@@ -24,11 +25,10 @@ def main():
     agent = PostmanClient("localhost", server_port, True)
     # false server cheats the real client
     false_server = PostmanServer(spy_path, agent)
+    if "capture_path" in cfg:
+        false_server.set_capture(CaptureWriter(os.path.expanduser(cfg["capture_path"])))
     try:
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server.bind(("localhost", client_port))
-        server.listen(5)
+        server = read_listener_config(cfg, client_port)
         conn, _ = server.accept()
         false_server.run(conn)
         false_server.print_server_log()
@@ -40,6 +40,9 @@ def main():
         false_server.print_server_log()
         server_log("Cannot establish connection", True)
         exit(3)
+    finally:
+        if false_server.capture is not None:
+            false_server.capture.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import signal
+import socket
+import tempfile
+import threading
+import subprocess
+
+# listener settings to compare, appended to the configuration of the server under test
+LISTENER_SETTINGS = {
+    "backlog 5": "listen_backlog=5\n",
+    "default backlog": "",
+}
+BURST_SIZE = 500
+CONNECT_TIMEOUT = 5.0
+
+def connect_burst(port: int, burst_size: int) -> tuple[list, int]:
+    """Open a burst of connections at once and measure how long every connect() takes.
+
+    Args:
+        port (int): The port of the server
+        burst_size (int): The number of connections
+
+    Returns:
+        tuple[list, int]: The connect latencies in seconds, and the number of dropped connections
+    """
+    latencies, dropped = [], 0
+    result_lock = threading.Lock()
+    start_line = threading.Barrier(burst_size)
+
+    def connect_once():
+        nonlocal dropped
+        start_line.wait()
+        started_at = time.monotonic()
+        try:
+            with socket.create_connection(("127.0.0.1", port), CONNECT_TIMEOUT):
+                latency = time.monotonic() - started_at
+            with result_lock:
+                latencies.append(latency)
+        except OSError:
+            with result_lock:
+                dropped += 1
+
+    clients = [threading.Thread(target=connect_once) for _ in range(burst_size)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return latencies, dropped
+
+def measure_setting(entry_point: str, port: int, extra_cfg: str) -> tuple[list, int]:
+    """Start a server with a listener setting and run a connect burst against it.
+
+    Args:
+        entry_point (str): The server script
+        port (int): The port to listen on
+        extra_cfg (str): The configuration lines of the listener setting
+
+    Returns:
+        tuple[list, int]: See connect_burst
+    """
+    with tempfile.TemporaryDirectory() as work_path:
+        cfg_path = os.path.join(work_path, "conf.txt")
+        with open(cfg_path, mode="w", encoding="utf-8") as cfg_file:
+            cfg_file.write(f"server_port={port}\ninbox_path={work_path}\n" + extra_cfg)
+        server = subprocess.Popen([sys.executable, entry_point, cfg_path],
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(50):   # wait until the server listens
+                try:
+                    socket.create_connection(("127.0.0.1", port), 1).close()
+                    break
+                except ConnectionRefusedError:
+                    time.sleep(0.1)
+            return connect_burst(port, BURST_SIZE)
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(5)
+            except subprocess.TimeoutExpired:   # SIGINT may land in a fork and get lost
+                server.kill()
+                server.wait()
+
+def main():
+    entry_point = sys.argv[1] if len(sys.argv) > 1 else "server.py"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 1026
+    for setting, extra_cfg in LISTENER_SETTINGS.items():
+        latencies, dropped = measure_setting(entry_point, port, extra_cfg)
+        latencies.sort()
+        if len(latencies) == 0:
+            print(f"{setting}: all {dropped} connections dropped")
+            continue
+        median = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000
+        print(f"{setting}: median {median:.2f}ms, p99 {p99:.2f}ms, "
+              f"max {latencies[-1] * 1000:.2f}ms, dropped {dropped}/{BURST_SIZE}")
+        port += 1   # the old port may linger in TIME_WAIT
+
+if __name__ == '__main__':
+    main()
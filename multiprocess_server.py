@@ -1,10 +1,13 @@
 
 import os
 import sys
-import socket
 import signal
 from utils import read_config, server_log
 from postman_server import PostmanServer
+from postman_profiler import ProfilingSwitch
+from postman_admission import read_admission_config
+from postman_listener import read_listener_config
+from postman_storage import read_storage_config, start_segment_compactor, DurableStore
 
 
 # This is just a sample pair of ID and Secret
@@ -13,6 +16,7 @@ PERSONAL_SECRET = 'b4b52156ba5213240a2315b0bc5412ed'
 
 def main():
     children: list = []
+    sessions: dict = {}   # child PID -> the IPv4 address of its client
     order: int = 0
     pid: int = os.getpid()
     try:
@@ -23,27 +27,69 @@ def main():
         if not cfg["server_port"].isdigit() or not os.path.isdir(inbox_path):
             exit(2)
         server_port = int(cfg["server_port"])
-        manager = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        manager.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        manager.bind(("localhost", server_port))
-        manager.listen(5)
+        # SIGUSR1 turns profiling on or off, SIGUSR2 reloads the profiling preferences
+        # forked children inherit the switch as it is when they are forked
+        profiling = ProfilingSwitch(cfg)
+        signal.signal(signal.SIGUSR1, lambda *_: profiling.toggle())
+
+        def reload_profiling(*_):
+            # a bad value must neither kill the server nor half-apply the preferences
+            try:
+                profiling.configure(read_config(sys.argv[1]))
+            except (ValueError, OSError) as err:
+                server_log(f"Profiling preferences not reloaded: {err}")
+
+        signal.signal(signal.SIGUSR2, reload_profiling)
+        admission = read_admission_config(cfg)
+        start_segment_compactor(cfg)   # the listener compacts, sessions only append
+        manager = read_listener_config(cfg, server_port)
         while True:
             # accept() MUST be blocking or your computer goes to the hell
-            client, _ = manager.accept()
+            client, (peer_ip, _) = manager.accept()
+            if admission is not None:
+                # finished children give their sessions back before admitting a new one
+                while len(sessions) > 0:
+                    done_pid, _ = os.waitpid(-1, os.WNOHANG)
+                    if done_pid == 0:
+                        break
+                    admission.release(sessions.pop(done_pid))
+                    children.remove(done_pid)
+                if not admission.admit(peer_ip):
+                    # 421 straight away, neither a fork nor a server is spent on the client
+                    admission.reject(client)
+                    continue
             pid = os.fork()
             if pid == 0:  # child process
+                manager.close()   # drops the copies of connections queued for others
                 staff = PostmanServer(inbox_path, instant_logging=True)
                 staff.set_credential(PERSONAL_ID, PERSONAL_SECRET)
+                if "max_message_size" in cfg:
+                    staff.set_max_message_size(int(cfg["max_message_size"]))
                 staff.set_multiprocess_info(os.getpid(), order + 1)
+                if admission is not None:
+                    staff.set_admission(admission, peer_ip)
+                storage = read_storage_config(cfg)
+                if storage is not None:
+                    staff.set_storage(storage)
+                profiler = profiling.session_profiler(staff.prefix)
                 try:
-                    staff.run(client)
+                    if profiler is not None:
+                        staff.set_profiler(profiler)
+                        profiler.run(staff.run, client)
+                    else:
+                        staff.run(client)
                 except ConnectionResetError:
                     server_log("Connection lost", prefix=staff.prefix)
                 finally:
+                    if isinstance(storage, DurableStore):
+                        server_log(storage.summary(), prefix=staff.prefix)
                     exit()   # the child process MUST terminate or your computer goes to the hell
             else:
+                client.close()
                 order += 1
                 children.append(pid)
+                if admission is not None:
+                    sessions[pid] = peer_ip
         manager.close()
     except KeyboardInterrupt:
         if pid > 0:   # parent process
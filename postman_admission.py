@@ -0,0 +1,220 @@
+import mmap
+import time
+import socket
+import struct
+import multiprocessing
+from postman_states import PostmanStates
+
+# the peer IPv4 address, its number of sessions, then (tokens, last refill) of every bucket
+PEER_SLOT = struct.Struct("=II6d")
+CONN_BUCKET, CMD_BUCKET, MSG_BUCKET = 0, 1, 2
+
+
+class AdmissionControl:
+    """Per-peer admission control and token bucket rate limiting.
+
+    The state lives in an anonymous shared memory map guarded by a process-shared lock,
+    so forked workers of the multiprocess server all see and update the same counters.
+    """
+    max_sessions: int
+    rates: tuple
+    bursts: tuple
+    slot_count: int
+
+    def __init__(self, max_sessions: int = 0, conn_rate: float = 0, cmd_rate: float = 0,
+                 msg_rate: float = 0, slot_count: int = 4096):
+        """Initialise the admission control. It must be done before forking workers.
+
+        Args:
+            max_sessions (int, optional): Concurrent sessions allowed per peer,
+            0 for unlimited. Defaults to 0.
+            conn_rate (float, optional): New connections per second per peer,
+            0 for unlimited. Defaults to 0.
+            cmd_rate (float, optional): Commands per second per peer,
+            0 for unlimited. Defaults to 0.
+            msg_rate (float, optional): Messages per second per peer,
+            0 for unlimited. Defaults to 0.
+            slot_count (int, optional): How many peers can be tracked at once. Defaults to 4096.
+        """
+        self.max_sessions = max_sessions
+        self.rates = (conn_rate, cmd_rate, msg_rate)
+        # a peer may burst up to one second worth of tokens, but at least one
+        self.bursts = tuple(max(rate, 1.0) for rate in self.rates)
+        self.slot_count = slot_count
+        self.shared = mmap.mmap(-1, PEER_SLOT.size * slot_count)
+        self.lock = multiprocessing.Lock()
+
+    def find_slot(self, peer_ip: str) -> tuple[int, list]:
+        """Find the slot of a peer, taking over an empty or forgettable slot for a new peer.
+           The caller must hold the lock.
+
+        Args:
+            peer_ip (str): The IPv4 address of the peer
+
+        Returns:
+            tuple[int, list]: The slot index and the slot fields,
+            or (-1, []) when the table is full of active peers
+        """
+        peer_key = struct.unpack("!I", socket.inet_aton(peer_ip))[0] or 0xFFFFFFFF
+        spare_index = -1
+        now = time.monotonic()
+        for probe in range(self.slot_count):
+            index = (peer_key + probe) % self.slot_count
+            fields = list(PEER_SLOT.unpack_from(self.shared, index * PEER_SLOT.size))
+            if fields[0] == peer_key:
+                return index, fields
+            if fields[0] == 0:
+                if spare_index < 0:
+                    spare_index = index
+                break   # the key would have been placed here if it existed
+            if spare_index < 0 and self.is_forgettable(fields, now):
+                spare_index = index
+        if spare_index < 0:
+            return -1, []
+        return spare_index, [peer_key, 0, self.bursts[0], now, self.bursts[1], now,
+                             self.bursts[2], now]
+
+    def is_forgettable(self, fields: list, now: float) -> bool:
+        """Check if a slot can be handed to another peer without losing any state, i.e. its
+           peer has no session and every token bucket has refilled.
+
+        Args:
+            fields (list): The slot fields
+            now (float): The current time.monotonic()
+
+        Returns:
+            bool: True for the slot is the same as a fresh one
+        """
+        if fields[1] > 0:
+            return False
+        for bucket, rate in enumerate(self.rates):
+            tokens_at, refilled_at = 2 + bucket * 2, 3 + bucket * 2
+            if rate > 0 and \
+                    fields[tokens_at] + (now - fields[refilled_at]) * rate < self.bursts[bucket]:
+                return False
+        return True
+
+    def take_token(self, fields: list, bucket: int) -> bool:
+        """Refill a token bucket of a slot and take one token from it.
+
+        Args:
+            fields (list): The slot fields
+            bucket (int): CONN_BUCKET, CMD_BUCKET or MSG_BUCKET
+
+        Returns:
+            bool: True for a token was taken, False for the peer is over the limit
+        """
+        rate = self.rates[bucket]
+        if rate <= 0:
+            return True
+        now = time.monotonic()
+        tokens_at, refilled_at = 2 + bucket * 2, 3 + bucket * 2
+        fields[tokens_at] = min(self.bursts[bucket],
+                                fields[tokens_at] + (now - fields[refilled_at]) * rate)
+        fields[refilled_at] = now
+        if fields[tokens_at] < 1:
+            return False
+        fields[tokens_at] -= 1
+        return True
+
+    def consume(self, peer_ip: str, bucket: int, new_session: bool = False) -> bool:
+        """Take a token of a peer and optionally start a new session for it.
+
+        Args:
+            peer_ip (str): The IPv4 address of the peer
+            bucket (int): CONN_BUCKET, CMD_BUCKET or MSG_BUCKET
+            new_session (bool, optional): Whether to also check and count a new session.
+            Defaults to False.
+
+        Returns:
+            bool: True for the peer is within its limits
+        """
+        with self.lock:
+            index, fields = self.find_slot(peer_ip)
+            if index < 0:
+                return True   # too many peers to track, fail open
+            if new_session and 0 < self.max_sessions <= fields[1]:
+                return False
+            allowed = self.take_token(fields, bucket)
+            if allowed and new_session:
+                fields[1] += 1
+            PEER_SLOT.pack_into(self.shared, index * PEER_SLOT.size, *fields)
+            return allowed
+
+    def admit(self, peer_ip: str) -> bool:
+        """Decide whether a new connection is accepted. An admitted session must be released.
+
+        Args:
+            peer_ip (str): The IPv4 address of the peer
+
+        Returns:
+            bool: True for the connection is admitted
+        """
+        return self.consume(peer_ip, CONN_BUCKET, new_session=True)
+
+    def allow_command(self, peer_ip: str) -> bool:
+        """Decide whether a peer may run one more command.
+
+        Args:
+            peer_ip (str): The IPv4 address of the peer
+
+        Returns:
+            bool: True for the command is allowed
+        """
+        return self.consume(peer_ip, CMD_BUCKET)
+
+    def allow_message(self, peer_ip: str) -> bool:
+        """Decide whether a peer may deliver one more message.
+
+        Args:
+            peer_ip (str): The IPv4 address of the peer
+
+        Returns:
+            bool: True for the message is allowed
+        """
+        return self.consume(peer_ip, MSG_BUCKET)
+
+    def release(self, peer_ip: str):
+        """End an admitted session of a peer.
+
+        Args:
+            peer_ip (str): The IPv4 address of the peer
+        """
+        with self.lock:
+            index, fields = self.find_slot(peer_ip)
+            if index >= 0 and fields[1] > 0:
+                fields[1] -= 1
+                PEER_SLOT.pack_into(self.shared, index * PEER_SLOT.size, *fields)
+
+    @staticmethod
+    def reject(conn: socket.socket):
+        """Turn a connection away with a 421 reply, without running a server for it.
+
+        Args:
+            conn (socket.socket): The accepted connection
+        """
+        try:
+            conn.sendall(f"{PostmanStates.SERVICE_NOT_AVAILABLE.value} "
+                         "Service not available, closing transmission channel\r\n"
+                         .encode("ascii"))
+        except OSError:
+            pass
+        conn.close()
+
+
+def read_admission_config(cfg: dict) -> AdmissionControl | None:
+    """Create the admission control described by a server configuration.
+
+    Args:
+        cfg (dict): The server configuration
+
+    Returns:
+        AdmissionControl | None: The admission control, or None if no limit is configured
+    """
+    limit_keys = ["max_sessions_per_ip", "conn_rate_per_ip", "cmd_rate_per_ip", "msg_rate_per_ip"]
+    if not any(key in cfg for key in limit_keys):
+        return None
+    return AdmissionControl(int(cfg.get("max_sessions_per_ip", "0")),
+                            float(cfg.get("conn_rate_per_ip", "0")),
+                            float(cfg.get("cmd_rate_per_ip", "0")),
+                            float(cfg.get("msg_rate_per_ip", "0")))
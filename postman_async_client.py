@@ -0,0 +1,196 @@
+import asyncio
+from utils import is_last_reply_line
+from postman_client import ClientSession
+from postman_transaction import Transaction
+
+
+class AsyncPostmanClient(ClientSession):
+    """The Postman SMTP Client for asyncio, so that many sessions run in one process.
+
+    Raises:
+        ConnectionResetError: Connection reset by the server
+        TimeoutError: The server does not answer in time
+    """
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    timeout: float
+
+    def __init__(self, address: str, port: int, timeout: float = 30.0):
+        """Initialise the asynchronous Postman Client.
+
+        Args:
+            address (str): The address of the target server.
+            port (int): The port of the target server.
+            timeout (float, optional): Seconds to wait for connecting or for a server reply.
+            Defaults to 30.0.
+        """
+        self.address = address
+        self.port = port
+        self.timeout = timeout
+        self.my_msgs = []
+        self.peer_msgs = []
+
+    async def connect(self):
+        """Connect to the specified server
+        """
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.address, self.port), self.timeout)
+
+    async def disconnect(self):
+        """Disconnect from the server
+        """
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    async def receive(self) -> list:
+        """Receive a whole reply from the server, however many lines or packets it takes.
+
+        Raises:
+            ConnectionResetError: Connection reset by the server
+            TimeoutError: The server does not answer in time
+
+        Returns:
+            list: The server response as a list of parameters
+        """
+        reply_lines = []
+        while len(reply_lines) == 0 or not is_last_reply_line(reply_lines[-1]):
+            reply_line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not reply_line.endswith(b"\r\n"):
+                raise ConnectionResetError("client")
+            reply_lines.append(reply_line[0:-2].decode("ascii"))
+        return self.accept_reply(reply_lines)
+
+    async def send(self, message: str):
+        """Send a message to the target server.
+
+        Args:
+            message (str): The whole message string
+        """
+        self.writer.write(message.encode("ascii"))
+        await self.writer.drain()
+
+    async def run(self, cmd: str, *params: str) -> list:
+        """Send a command line and get feedback in the interactive SMTP session.
+
+        Args:
+            cmd (str): command name
+            *args (str): arguments
+
+        Returns:
+            list: The server response as a list of parameters
+        """
+        return await self.request(self.command_line(cmd, *params))
+
+    async def request(self, message: str) -> list:
+        """Send a line and get feedback in the interactive SMTP session.
+           A carriage return will be added for you
+
+        Args:
+            message (str): The whole message
+
+        Returns:
+            list: The server response as a list of parameters
+        """
+        self.my_msgs.append(message)
+        await self.send(message + "\r\n")
+        return await self.receive()
+
+    async def send_chunk(self, chunk: bytes, last: bool) -> list:
+        """Send a BDAT command with its binary chunk and get feedback.
+
+        Args:
+            chunk (bytes): The chunk
+            last (bool): Whether it is the last chunk of the email
+
+        Returns:
+            list: The server response as a list of parameters
+        """
+        self.writer.write(self.chunk_message(chunk, last))
+        await self.writer.drain()
+        return await self.receive()
+
+    async def send_email(self, transaction_data: Transaction, chunking: bool = False,
+                         chunk_size: int = 65536):
+        """Send an email to the SMTP server.
+
+        Args:
+            transaction_data (Transaction): The transaction object
+            chunking (bool, optional): Whether to send the email in BDAT chunks instead of
+            line by line, if the server supports CHUNKING. Defaults to False.
+            chunk_size (int, optional): The size of BDAT chunks. Defaults to 65536.
+        """
+        for step in self.email_steps(transaction_data, chunking, chunk_size):
+            if isinstance(step, str):
+                await self.request(step)
+            else:
+                await self.send_chunk(*step)
+
+
+class DeliveryError(Exception):
+    """A failed session, carrying its client so that the session log can still be printed.
+    The exception the session ended with is the cause.
+    """
+    pm_client: AsyncPostmanClient
+
+    def __init__(self, pm_client: AsyncPostmanClient):
+        super().__init__("delivery failed")
+        self.pm_client = pm_client
+
+
+async def deliver(address: str, port: int, txn: Transaction,
+                  timeout: float = 30.0) -> AsyncPostmanClient:
+    """Deliver one email in its own session.
+
+    Args:
+        address (str): The address of the target server.
+        port (int): The port of the target server.
+        txn (Transaction): The email
+        timeout (float, optional): Seconds to wait for the server. Defaults to 30.0.
+
+    Raises:
+        DeliveryError: The session failed
+
+    Returns:
+        AsyncPostmanClient: The client of the finished session, holding its logs
+    """
+    pm_client = AsyncPostmanClient(address, port, timeout)
+    try:
+        await pm_client.connect()
+        await pm_client.receive()
+        ehlo_resp = await pm_client.run("EHLO", "127.0.0.1")
+        await pm_client.send_email(txn, chunking="CHUNKING" in ehlo_resp)
+        await pm_client.run("QUIT")
+    except Exception as err:
+        raise DeliveryError(pm_client) from err
+    finally:
+        # a failed session must not leave its socket to the garbage collector
+        try:
+            if hasattr(pm_client, "writer"):
+                await pm_client.disconnect()
+        except OSError:
+            pass   # the connection is already broken
+    return pm_client
+
+
+async def deliver_concurrently(address: str, port: int, transactions: list,
+                               concurrency: int = 100, timeout: float = 30.0) -> list:
+    """Deliver many emails with at most a given number of sessions at a time.
+
+    Args:
+        address (str): The address of the target server.
+        port (int): The port of the target server.
+        transactions (list): The emails
+        concurrency (int, optional): The most sessions at a time. Defaults to 100.
+        timeout (float, optional): Seconds to wait for the server. Defaults to 30.0.
+
+    Returns:
+        list: For every email in order, its finished client or the DeliveryError it ended with
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def deliver_in_slot(txn: Transaction):
+        async with slots:
+            return await deliver(address, port, txn, timeout)
+
+    return await asyncio.gather(*[deliver_in_slot(txn) for txn in transactions],
+                                return_exceptions=True)
@@ -0,0 +1,72 @@
+import time
+import base64
+from secrets import token_hex
+
+
+class CaptureWriter:
+    """Records every line of an SMTP session into a capture file.
+
+    Each record is one line "<session>\\t<microseconds>\\t<C|S|D>\\t<text>", where the
+    timestamp comes from the monotonic clock and multi-line messages are split into records.
+    A "D" record holds the binary chunk of the BDAT command before it, encoded in base64.
+    """
+    session_id: str
+
+    def __init__(self, capture_path: str, session_id: str = ""):
+        """Open a capture file for appending.
+
+        Args:
+            capture_path (str): The capture file path
+            session_id (str, optional): The session ID of the records. Defaults to a random one.
+        """
+        self.session_id = session_id if len(session_id) > 0 else token_hex(4)
+        self.capture_file = open(capture_path, mode="a", encoding="ascii", buffering=1)
+
+    def record(self, direction: str, msg: str):
+        """Record a message.
+
+        Args:
+            direction (str): "C" for the client, "S" for the server
+            msg (str): The message. It may consist of several lines joined by carriage returns.
+        """
+        timestamp = time.monotonic_ns() // 1000
+        self.capture_file.write("".join(f"{self.session_id}\t{timestamp}\t{direction}\t{line}\n"
+                                        for line in msg.split("\r\n")))
+
+    def record_chunk(self, chunk: bytes):
+        """Record the binary chunk of a BDAT command.
+
+        Args:
+            chunk (bytes): The chunk
+        """
+        timestamp = time.monotonic_ns() // 1000
+        self.capture_file.write(f"{self.session_id}\t{timestamp}\tD\t"
+                                f"{base64.b64encode(chunk).decode('ascii')}\n")
+
+    def close(self):
+        """Close the capture file.
+        """
+        self.capture_file.close()
+
+
+def read_capture(capture_path: str) -> dict:
+    """Read a capture file.
+
+    Args:
+        capture_path (str): The capture file path
+
+    Returns:
+        dict: Session ID -> a list of (timestamp in microseconds, direction, text) in order,
+        where the text of a "D" record is the decoded chunk in bytes
+    """
+    sessions: dict = {}
+    with open(capture_path, mode="r", encoding="ascii") as capture_file:
+        for record_line in capture_file:
+            fields = record_line.rstrip("\n").split("\t", 3)
+            if len(fields) != 4 or not fields[1].isdigit():
+                continue
+            session_id, timestamp, direction, text = fields
+            if direction == "D":
+                text = base64.b64decode(text)
+            sessions.setdefault(session_id, []).append((int(timestamp), direction, text))
+    return sessions
@@ -1,12 +1,100 @@
 
 import socket
-import regex
-from utils import is_smtp_message, server_log, client_log
+from utils import server_log, client_log, parse_smtp_reply, is_last_reply_line
 from postman_states import PostmanStates
 from postman_transaction import Transaction
 
 
-class PostmanClient:
+class ClientSession:
+    """What every Postman client does besides talking to the socket: building the lines it
+    sends, parsing the replies and keeping the session log. The blocking and the asyncio
+    client only differ in how the bytes are sent and received.
+    """
+    current_state: PostmanStates
+    my_msgs: list
+    peer_msgs: list
+
+    @staticmethod
+    def command_line(cmd: str, *params: str) -> str:
+        """Build a command line from a command name and its arguments.
+
+        Args:
+            cmd (str): command name
+            *params (str): arguments
+
+        Returns:
+            str: The command line without the carriage return
+        """
+        return cmd + (" " if len(params) > 0 else "") + " ".join(params)
+
+    def chunk_message(self, chunk: bytes, last: bool) -> bytes:
+        """Log a BDAT command and build it with its chunk.
+
+        Args:
+            chunk (bytes): The chunk
+            last (bool): Whether it is the last chunk of the email
+
+        Returns:
+            bytes: The command line followed by the chunk, ready to be sent
+        """
+        message = f"BDAT {len(chunk)}" + (" LAST" if last else "")
+        self.my_msgs.append(message)
+        return message.encode("ascii") + b"\r\n" + chunk
+
+    @staticmethod
+    def email_steps(transaction_data: Transaction, chunking: bool, chunk_size: int):
+        """Break sending an email down into what is sent and waits for a reply each.
+
+        Args:
+            transaction_data (Transaction): The transaction object
+            chunking (bool): Whether to send the email in BDAT chunks instead of line by line
+            chunk_size (int): The size of BDAT chunks
+
+        Yields:
+            str | tuple[bytes, bool]: A line to request, or a chunk and whether it is the last
+        """
+        yield f"MAIL FROM:<{transaction_data.sender}>"
+        for recipient in transaction_data.recipients:
+            yield f"RCPT TO:<{recipient}>"
+        if chunking:
+            message = "".join(line + "\r\n" for line in transaction_data.message_lines()) \
+                .encode("ascii")
+            for offset in range(0, max(len(message), 1), chunk_size):
+                yield message[offset:offset + chunk_size], offset + chunk_size >= len(message)
+            return
+        yield "DATA"
+        yield from transaction_data.message_lines()
+        yield "."
+
+    def accept_reply(self, reply_lines: list) -> list:
+        """Parse and log a whole server reply.
+
+        Args:
+            reply_lines (list): The reply lines without their carriage returns
+
+        Returns:
+            list: The server response as a list of parameters
+        """
+        msg = "\r\n".join(reply_lines)   # real SERVER response
+        parsed = parse_smtp_reply(msg)
+        assert parsed is not None, "bad server response" # however it should not happen
+        self.peer_msgs.append(msg)
+        resp_code, resp_params = parsed
+        self.current_state = PostmanStates(resp_code)
+        return resp_params
+
+    def print_client_log(self):
+        """Dump all log generated in client-server interactions to stdout.
+        """
+        while True:
+            try:
+                server_log(self.peer_msgs.pop(0))
+                client_log(self.my_msgs.pop(0))
+            except IndexError:
+                break
+
+
+class PostmanClient(ClientSession):
     """The Postman SMTP Client
 
     Raises:
@@ -15,9 +103,7 @@ class PostmanClient:
     buffer: str
     cli: socket.socket
     evil_mode: bool
-    current_state: PostmanStates
-    my_msgs: list
-    peer_msgs: list
+    timeout: float | None
 
     def receive(self) -> list:
         """Receive a message from the server.
@@ -28,19 +114,22 @@ class PostmanClient:
         Returns:
             list: The server response as a list of parameters
         """
-        resp = self.cli.recv(1024).decode("ascii")
-        if not is_smtp_message(resp):
-            raise ConnectionResetError("client")
-        resp_re = regex.compile(r"(([0-7]{3})(\s(.+)(\r\n)*)*)\r\n")
-        resp_match = resp_re.match(resp)
-        assert resp_match is not None, "bad server response" # however it should not happen
-        msg = resp_match.captures(1)[0]   # real SERVER response
-        self.peer_msgs.append(msg)
-        resp_code, resp_params = resp_match.captures(2)[0], resp_match.captures(4)
-        self.current_state = PostmanStates(resp_code)
-        return resp_params
-
-    def __init__(self, address: str, port: int, evil_mode: bool = False):
+        # a reply may arrive in pieces or span several lines, so read until its last line
+        reply_lines = []
+        while len(reply_lines) == 0 or not is_last_reply_line(reply_lines[-1]):
+            line_end = self.buffer.find("\r\n")
+            if line_end < 0:
+                received = self.cli.recv(1024).decode("ascii")
+                if len(received) == 0:
+                    raise ConnectionResetError("client")
+                self.buffer += received
+                continue
+            reply_lines.append(self.buffer[0:line_end])
+            self.buffer = self.buffer[line_end + 2:]
+        return self.accept_reply(reply_lines)
+
+    def __init__(self, address: str, port: int, evil_mode: bool = False,
+                 timeout: float | None = None):
         """Initialise the Postman Client.
 
         Args:
@@ -48,12 +137,16 @@ class PostmanClient:
             port (int): The port of the target server.
             evil_mode (bool, optional): Whether the client acts as an agent
             to transmit data from the eavesdropper to the real server. Defaults to False.
+            timeout (float | None, optional): Seconds to wait for connecting or for a server
+            reply, None to wait forever. Defaults to None.
         """
         self.address = address
         self.port = port
         self.evil_mode = evil_mode
+        self.timeout = timeout
         self.my_msgs = []
         self.peer_msgs = []
+        self.buffer = ""
 
     def send(self, message: str):
         """Send a message to the target server.
@@ -61,7 +154,7 @@ class PostmanClient:
         Args:
             message (str): The whole message string
         """
-        self.cli.send(message.encode("ascii"))
+        self.cli.sendall(message.encode("ascii"))
 
     def run(self, cmd: str, *params: str) -> list:
         """Send a command line and get feedback in the interactive SMTP session.
@@ -73,8 +166,7 @@ class PostmanClient:
         Returns:
             list: The server response as a list of parameters
         """
-        message = cmd + (" " if len(params) > 0 else "") + " ".join(params)
-        return self.request(message)
+        return self.request(self.command_line(cmd, *params))
 
     def request(self, message: str) -> list:
         """Send a line and get feedback in the interactive SMTP session.
@@ -91,41 +183,44 @@ class PostmanClient:
         self.send(message + "\r\n")
         return self.receive()
 
-    def send_email(self, transaction_data: Transaction):
+    def send_chunk(self, chunk: bytes, last: bool) -> list:
+        """Send a BDAT command with its binary chunk and get feedback.
+
+        Args:
+            chunk (bytes): The chunk
+            last (bool): Whether it is the last chunk of the email
+
+        Returns:
+            list: The server response as a list of parameters
+        """
+        self.cli.sendall(self.chunk_message(chunk, last))
+        return self.receive()
+
+    def send_email(self, transaction_data: Transaction, chunking: bool = False,
+                   chunk_size: int = 65536):
         """Send an email to the SMTP server.
 
         Args:
             transaction_data (Transaction): The transaction object
+            chunking (bool, optional): Whether to send the email in BDAT chunks instead of
+            line by line, if the server supports CHUNKING. Defaults to False.
+            chunk_size (int, optional): The size of BDAT chunks. Defaults to 65536.
         """
-        self.run("MAIL", f"FROM:<{transaction_data.sender}>")
-        for recipient in transaction_data.recipients:
-            self.run("RCPT", f"TO:<{recipient}>")
-        self.run("DATA")
-        if hasattr(transaction_data, "created_time_rfc5322"):
-            self.request("Date: " + transaction_data.created_time_rfc5322)
-        if hasattr(transaction_data, "subject"):
-            self.request("Subject: " + transaction_data.subject)
-        for line_text in transaction_data.content:
-            self.request(line_text)
-        self.request(".")
+        for step in self.email_steps(transaction_data, chunking, chunk_size):
+            if isinstance(step, str):
+                self.request(step)
+            else:
+                self.send_chunk(*step)
 
     def connect(self):
         """Connect to the specified server
         """
         self.cli = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.cli.settimeout(self.timeout)
         self.cli.connect((self.address, self.port))
+        self.buffer = ""
 
     def disconnect(self):
         """Disconnect from the server
         """
         self.cli.close()
-
-    def print_client_log(self):
-        """Dump all log generated in client-server interactions to stdout.
-        """
-        while True:
-            try:
-                server_log(self.peer_msgs.pop(0))
-                client_log(self.my_msgs.pop(0))
-            except IndexError:
-                break
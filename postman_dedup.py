@@ -0,0 +1,167 @@
+import os
+import re
+from pathlib import Path
+from postman_transaction import Transaction
+from utils import file_locked, replace_atomically
+
+BODY_REF_HEADER = "Body-Ref: sha256:"
+# the header lines Transaction.render_headers writes before the Body-Ref line
+HEADER_PREFIXES = (b"From: ", b"To: ", b"Date: ", b"Subject: ")
+
+
+class ContentStore:
+    """A content-addressed store of email bodies with reference counting.
+
+    Every unique body is stored once as objects/<first two hex digits>/<digest>, next to a
+    <digest>.refs file counting the inbox files referring to it. An inbox file then only
+    holds the header lines and a "Body-Ref: sha256:<digest>" line.
+    """
+    store_path: Path
+    hashes_body: bool = True
+
+    def __init__(self, store_path: str):
+        """Open a content store, creating its directories when they do not exist.
+
+        Args:
+            store_path (str): The root directory of the store
+        """
+        self.store_path = Path(store_path)
+        (self.store_path / "objects").mkdir(parents=True, exist_ok=True)
+
+    def locked(self):
+        """Hold the store-wide lock, which excludes other threads and processes.
+        """
+        return file_locked(self.store_path / ".lock")
+
+    def object_path(self, digest: str) -> Path:
+        """Get where a body is stored.
+
+        Args:
+            digest (str): The body digest
+
+        Returns:
+            Path: The object path
+        """
+        return self.store_path / "objects" / digest[0:2] / digest
+
+    def change_refs(self, digest: str, delta: int) -> int:
+        """Change the reference count of a body. The caller must hold the lock.
+
+        Args:
+            digest (str): The body digest
+            delta (int): How much to add to the count
+
+        Returns:
+            int: The new reference count
+        """
+        refs_path = self.object_path(digest).with_suffix(".refs")
+        refs = int(refs_path.read_text(encoding="ascii")) if refs_path.exists() else 0
+        refs = max(refs + delta, 0)
+        # a crash leaves either the old count or the new one
+        replace_atomically(refs_path, str(refs))
+        return refs
+
+    def store_body(self, digest: str, body: bytes):
+        """Store a body unless the same body is already stored, and reference it once more.
+
+        Args:
+            digest (str): The body digest
+            body (bytes): The rendered body
+        """
+        object_path = self.object_path(digest)
+        with self.locked():
+            if not object_path.exists():
+                object_path.parent.mkdir(exist_ok=True)
+                replace_atomically(object_path, body)
+            self.change_refs(digest, 1)
+
+    def save_durably(self, txn: Transaction, save_folder: str, file_prefix: str = ""):
+        """Save a transaction as an inbox file referring to its deduplicated body.
+
+        Args:
+            txn (Transaction): The transaction to save
+            save_folder (str): The inbox path
+            file_prefix (str, optional): The prefix of the filename. Defaults to "".
+        """
+        digest = txn.body_digest()
+        file_path = Path(save_folder) / txn.file_name(file_prefix)
+        if file_path.exists():
+            self.release(str(file_path))   # the old email is overwritten
+        # referencing before the inbox file exists can only leak a body, never lose one
+        self.store_body(digest, txn.render_body())
+        with open(file_path, mode="w", encoding="ascii") as inbox_file:
+            inbox_file.write(txn.render_headers() + BODY_REF_HEADER + digest + "\n")
+            inbox_file.flush()
+            os.fsync(inbox_file.fileno())
+
+    @staticmethod
+    def split_body_ref(data: bytes) -> tuple[bytes, str | None]:
+        """Split the data of an inbox file into its header lines and the body digest it refers
+           to. Only a Body-Ref line right after the header lines and ending the file counts, so
+           that a body quoting such a line is never mistaken for a reference.
+
+        Args:
+            data (bytes): The whole inbox file
+
+        Returns:
+            tuple[bytes, str | None]: The header lines and the body digest,
+            or the whole data and None if the file holds its body itself
+        """
+        line_start = 0
+        while line_start < len(data):
+            line_end = data.find(b"\n", line_start)
+            if line_end < 0:
+                break
+            text_line = data[line_start:line_end]
+            if text_line.startswith(BODY_REF_HEADER.encode("ascii")):
+                digest = text_line[len(BODY_REF_HEADER):]
+                if line_end + 1 == len(data) and re.fullmatch(rb"[0-9a-f]{64}", digest):
+                    return data[0:line_start], digest.decode("ascii")
+                break
+            if not text_line.startswith(HEADER_PREFIXES):   # the body starts here
+                break
+            line_start = line_end + 1
+        return data, None
+
+    @classmethod
+    def body_ref(cls, file_path: str) -> str | None:
+        """Get the body digest an inbox file refers to.
+
+        Args:
+            file_path (str): The inbox file path
+
+        Returns:
+            str | None: The body digest, or None if the file holds its body itself
+        """
+        with open(file_path, mode="rb") as inbox_file:   # the body may be binary
+            return cls.split_body_ref(inbox_file.read())[1]
+
+    def read(self, file_path: str) -> bytes:
+        """Read an inbox file with its body put back in place.
+
+        Args:
+            file_path (str): The inbox file path
+
+        Returns:
+            bytes: The whole email as saved without deduplication
+        """
+        with open(file_path, mode="rb") as inbox_file:
+            headers, digest = self.split_body_ref(inbox_file.read())
+        if digest is None:
+            return headers
+        return headers + self.object_path(digest).read_bytes()
+
+    def release(self, file_path: str):
+        """Delete an inbox file and its body once no inbox file refers to the body anymore.
+
+        Args:
+            file_path (str): The inbox file path
+        """
+        digest = self.body_ref(file_path)
+        os.remove(file_path)
+        if digest is None:
+            return
+        with self.locked():
+            if self.change_refs(digest, -1) == 0:
+                self.object_path(digest).unlink(missing_ok=True)
+                self.object_path(digest).with_suffix(".refs").unlink(missing_ok=True)
@@ -0,0 +1,136 @@
+import os
+import threading
+from enum import Enum
+from pathlib import Path
+from utils import replace_atomically
+
+
+class DeliveryStatus(Enum):
+    """All possible outcomes of delivering one spool file.
+    """
+    SENT = "sent"
+    FAILED = "failed"
+    BAD_FORMATION = "bad-formation"
+
+
+class DeliveryJournal:
+    """An append-only, crash-safe record of which spool files have been delivered.
+
+    Each line of the journal is "<status>\\t<file name>". The latest line of a file wins.
+    A torn last line (no trailing newline) left by a crash is dropped on load. Given the spool
+    directory, compaction also forgets the files which are no longer in the spool.
+    """
+    journal_path: Path
+    spool_path: Path | None
+    statuses: dict
+    completed: set
+    record_count: int
+    compact_threshold: int
+
+    def __init__(self, journal_path: str, compact_threshold: int = 1024,
+                 spool_path: str | None = None):
+        """Open a delivery journal, creating it when it does not exist.
+           Files which left the spool are forgotten right away.
+
+        Args:
+            journal_path (str): Where the journal file lives
+            compact_threshold (int, optional): Compact the journal once it holds this many
+            more records than distinct files. Defaults to 1024.
+            spool_path (str | None, optional): The spool directory of the journalled files.
+            Defaults to None, which keeps every file forever.
+        """
+        self.journal_path = Path(journal_path)
+        self.spool_path = Path(spool_path) if spool_path is not None else None
+        self.statuses = {}
+        self.completed = set()
+        self.record_count = 0
+        self.compact_threshold = compact_threshold
+        self.lock = threading.Lock()
+        self.load()
+        self.journal_file = open(self.journal_path, mode="a", encoding="utf-8")
+        if self.spool_path is not None \
+        and not set(self.statuses).issubset(os.listdir(self.spool_path)):
+            self.compact()
+
+    def load(self):
+        """Rebuild the in-memory state from the journal file.
+           A torn last line is cut off so that later appends start on a fresh line.
+        """
+        if not self.journal_path.exists():
+            return
+        with open(self.journal_path, mode="rb") as journal_file:
+            journal_data = journal_file.read()
+        intact_size = journal_data.rfind(b"\n") + 1
+        if intact_size < len(journal_data):
+            os.truncate(self.journal_path, intact_size)
+        for journal_line in journal_data[0:intact_size].decode("utf-8").splitlines():
+            if "\t" not in journal_line:
+                continue
+            status, file_name = journal_line.split("\t", 1)
+            try:
+                self.apply(DeliveryStatus(status), file_name)
+            except ValueError:
+                continue
+            self.record_count += 1
+
+    def apply(self, status: DeliveryStatus, file_name: str):
+        """Apply a status change to the in-memory state only.
+
+        Args:
+            status (DeliveryStatus): The delivery outcome
+            file_name (str): The spool file name
+        """
+        self.statuses[file_name] = status
+        if status in (DeliveryStatus.SENT, DeliveryStatus.BAD_FORMATION):
+            self.completed.add(file_name)
+        else:
+            self.completed.discard(file_name)
+
+    def is_completed(self, file_name: str) -> bool:
+        """Check if a spool file needs no further delivery attempt.
+
+        Args:
+            file_name (str): The spool file name
+
+        Returns:
+            bool: True for the file was sent or can never be sent
+        """
+        return file_name in self.completed
+
+    def record(self, file_name: str, status: DeliveryStatus):
+        """Durably append a delivery outcome to the journal.
+
+        Args:
+            file_name (str): The spool file name
+            status (DeliveryStatus): The delivery outcome
+        """
+        with self.lock:
+            self.journal_file.write(f"{status.value}\t{file_name}\n")
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+            self.apply(status, file_name)
+            self.record_count += 1
+            if self.record_count - len(self.statuses) >= self.compact_threshold:
+                self.compact()
+
+    def compact(self):
+        """Rewrite the journal with only the latest status of every file still in the spool.
+           The new journal replaces the old one atomically.
+        """
+        if self.spool_path is not None:
+            spool_files = set(os.listdir(self.spool_path))
+            for file_name in [file_name for file_name in self.statuses
+                              if file_name not in spool_files]:
+                del self.statuses[file_name]
+                self.completed.discard(file_name)
+        replace_atomically(self.journal_path,
+                           "".join(f"{status.value}\t{file_name}\n"
+                                   for file_name, status in self.statuses.items()))
+        self.journal_file.close()
+        self.journal_file = open(self.journal_path, mode="a", encoding="utf-8")
+        self.record_count = len(self.statuses)
+
+    def close(self):
+        """Close the journal file.
+        """
+        self.journal_file.close()
@@ -0,0 +1,121 @@
+import os
+import time
+import errno
+import socket
+import select
+from collections import deque
+from utils import server_log
+
+# accept() errors which only end the current batch: out of file descriptors or kernel memory,
+# or a connection reset before it was accepted
+BATCH_ENDING_ERRORS = (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM,
+                       errno.ECONNABORTED)
+# seconds to wait before accepting again when no file descriptor is left
+EXHAUSTED_BACKOFF = 0.1
+
+
+class Listener:
+    """A listening socket which drains every pending connection whenever it wakes up.
+
+    The listening socket is non-blocking, so that one wakeup accepts the whole burst waiting
+    in the backlog, while the caller still sees a blocking accept() handing out one
+    connection at a time. A batch takes at most accept_batch connections, the rest stay in
+    the kernel backlog until the batch is handed out.
+    """
+    listener: socket.socket
+    pending: deque
+    nodelay: bool
+    keepalive: bool
+    accept_batch: int
+
+    def __init__(self, port: int, address: str = "localhost", backlog: int = socket.SOMAXCONN,
+                 nodelay: bool = False, keepalive: bool = False, defer_accept: int = 0,
+                 accept_batch: int = 16):
+        """Bind and listen.
+
+        Args:
+            port (int): The port to listen on
+            address (str, optional): The address to bind. Defaults to "localhost".
+            backlog (int, optional): The most connections waiting to be accepted.
+            Defaults to socket.SOMAXCONN.
+            nodelay (bool, optional): Whether accepted connections disable the Nagle algorithm.
+            Defaults to False.
+            keepalive (bool, optional): Whether accepted connections send TCP keepalives.
+            Defaults to False.
+            defer_accept (int, optional): Seconds to wait for the first data before a
+            connection is accepted, 0 for no wait. Ignored where TCP_DEFER_ACCEPT is missing.
+            Only useful when the client speaks first: an SMTP client waits for the 220
+            greeting, so every session would be delayed by the whole timeout. Defaults to 0.
+            accept_batch (int, optional): The most connections accepted in one wakeup and held
+            by the listener. Defaults to 16.
+        """
+        self.nodelay = nodelay
+        self.accept_batch = max(accept_batch, 1)
+        self.keepalive = keepalive
+        self.pending = deque()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if defer_accept > 0 and hasattr(socket, "TCP_DEFER_ACCEPT"):
+            self.listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, defer_accept)
+        self.listener.bind((address, port))
+        self.listener.listen(backlog)
+        self.listener.setblocking(False)
+
+    def accept(self) -> tuple[socket.socket, tuple]:
+        """Wait for a connection like socket.accept(). The connection is blocking.
+
+        Returns:
+            tuple[socket.socket, tuple]: The connection and the address of its peer
+        """
+        while len(self.pending) == 0:
+            select.select([self.listener], [], [])
+            # accept until the backlog is empty or the batch is full, one wakeup serves a burst
+            while len(self.pending) < self.accept_batch:
+                try:
+                    self.pending.append(self.listener.accept())
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError as err:
+                    if err.errno not in BATCH_ENDING_ERRORS:
+                        raise
+                    if len(self.pending) == 0 and err.errno != errno.ECONNABORTED:
+                        # the backlog keeps the listener readable, wait for a descriptor
+                        server_log(f"Accept postponed: {os.strerror(err.errno)}")
+                        time.sleep(EXHAUSTED_BACKOFF)
+                    break
+        conn, peer_address = self.pending.popleft()
+        conn.setblocking(True)
+        if self.nodelay:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.keepalive:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return conn, peer_address
+
+    def close(self):
+        """Close the listening socket and the connections which are not handed out yet.
+        """
+        while len(self.pending) > 0:
+            self.pending.popleft()[0].close()
+        self.listener.close()
+
+
+def read_listener_config(cfg: dict, port: int) -> Listener:
+    """Create the listener described by a configuration.
+       tcp_defer_accept is refused, since SMTP servers speak first.
+
+    Args:
+        cfg (dict): The configuration
+        port (int): The port to listen on
+
+    Returns:
+        Listener: The listener
+    """
+    if int(cfg.get("tcp_defer_accept", "0")) > 0:
+        # the kernel would hold every connection until the timeout, as no client sends
+        # anything before the 220 greeting
+        server_log("tcp_defer_accept ignored: SMTP clients wait for the server to speak first")
+    return Listener(port, cfg.get("bind_address", "localhost"),
+                    int(cfg.get("listen_backlog", str(socket.SOMAXCONN))),
+                    cfg.get("tcp_nodelay", "0") == "1",
+                    cfg.get("tcp_keepalive", "0") == "1",
+                    accept_batch=int(cfg.get("accept_batch", "16")))
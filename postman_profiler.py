@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import random
+import threading
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager
+
+
+class SessionProfiler:
+    """Profiles one server session. Every kind of profiling is optional:
+       cProfile around the whole session, tracemalloc snapshots around chosen code blocks
+       and a wall-clock sampler dumping folded stacks of the session thread.
+    """
+    profile_dir: Path
+    tag: str
+    cpu: bool
+    memory: bool
+    sample_interval: float
+    stack_counts: Counter
+
+    def __init__(self, profile_dir: str, tag: str, cpu: bool = True, memory: bool = False,
+                 sample_interval: float = 0.0):
+        """Initialise a session profiler.
+
+        Args:
+            profile_dir (str): The directory for the profiling outputs
+            tag (str): The prefix of the output file names, usually the server prefix
+            cpu (bool, optional): Whether to run cProfile. Defaults to True.
+            memory (bool, optional): Whether to take tracemalloc snapshots. Defaults to False.
+            sample_interval (float, optional): Seconds between two stack samples,
+            0 for no sampling. Defaults to 0.0.
+        """
+        self.profile_dir = Path(profile_dir)
+        self.tag = tag
+        self.cpu = cpu
+        self.memory = memory
+        self.sample_interval = sample_interval
+        self.stack_counts = Counter()
+        self.sampling = False
+
+    def output_path(self, suffix: str) -> Path:
+        """Get the path of an output file.
+
+        Args:
+            suffix (str): The file name suffix
+
+        Returns:
+            Path: The output path
+        """
+        return self.profile_dir / (self.tag + suffix)
+
+    def run(self, func, *args):
+        """Call a function under the enabled profilers and dump their outputs afterwards.
+
+        Args:
+            func (Callable): The function to profile, usually PostmanServer.run
+            *args (Any): The arguments of the function
+
+        Returns:
+            Any: The return value of the function
+        """
+        sampler = None
+        if self.sample_interval > 0:
+            self.sampling = True
+            sampler = threading.Thread(target=self.sample, args=(threading.get_ident(),),
+                                       daemon=True)
+            sampler.start()
+        profile = None
+        if self.cpu:
+            import cProfile   # only profiled sessions pay for importing the profilers
+            profile = cProfile.Profile()
+        try:
+            if profile is not None:
+                return profile.runcall(func, *args)
+            return func(*args)
+        finally:
+            if profile is not None:
+                profile.dump_stats(str(self.output_path(".prof")))
+            if sampler is not None:
+                self.sampling = False
+                sampler.join()
+                self.dump_stacks()
+
+    def sample(self, thread_id: int):
+        """Periodically record the stack of a thread until sampling stops.
+
+        Args:
+            thread_id (int): The thread to sample
+        """
+        while self.sampling:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.stack_counts[";".join(reversed(stack))] += 1
+            time.sleep(self.sample_interval)
+
+    def dump_stacks(self):
+        """Write the sampled stacks in the folded format of flame graph tools.
+        """
+        with open(self.output_path(".stacks.txt"), mode="w", encoding="utf-8") as stack_file:
+            for stack, count in self.stack_counts.most_common():
+                print(f"{stack} {count}", file=stack_file)
+
+    @contextmanager
+    def trace_memory(self, label: str):
+        """Take tracemalloc snapshots around a code block and log the top allocations.
+
+        Args:
+            label (str): The name of the code block in the output
+        """
+        if not self.memory:
+            yield
+            return
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            with open(self.output_path(".mem.txt"), mode="a", encoding="utf-8") as mem_file:
+                print(f"== {label}", file=mem_file)
+                for stat in after.compare_to(before, "lineno")[0:10]:
+                    print(stat, file=mem_file)
+
+
+class ProfilingSwitch:
+    """Decides which sessions of a server get profiled and how.
+       The switch can be flipped or reconfigured at runtime, e.g. from a signal handler.
+    """
+    enabled: bool
+    profile_dir: str
+    sample_rate: float
+    cpu: bool
+    memory: bool
+    sample_interval: float
+
+    def __init__(self, cfg: dict):
+        """Initialise the switch from the server configuration.
+
+        Args:
+            cfg (dict): The server configuration
+        """
+        self.enabled = False
+        self.configure(cfg)
+
+    def configure(self, cfg: dict):
+        """Apply the profiling preferences of a configuration, all of them or none.
+
+        Args:
+            cfg (dict): The server configuration
+
+        Raises:
+            ValueError: A preference has a bad value, and the old preferences are kept
+        """
+        profile_dir = os.path.expanduser(cfg.get("profile_path", ""))
+        enabled = cfg.get("profile_enabled", "1" if self.enabled else "0") == "1" \
+            and len(profile_dir) > 0
+        sample_rate = float(cfg.get("profile_sample_rate", "1"))
+        cpu = cfg.get("profile_cpu", "1") == "1"
+        memory = cfg.get("profile_memory", "0") == "1"
+        sample_interval = float(cfg.get("profile_sampler_interval", "0"))
+        self.profile_dir, self.enabled, self.sample_rate, self.cpu, self.memory, \
+            self.sample_interval = profile_dir, enabled, sample_rate, cpu, memory, sample_interval
+
+    def toggle(self):
+        """Turn profiling on when it is off and vice versa.
+        """
+        self.enabled = not self.enabled and len(self.profile_dir) > 0
+
+    def session_profiler(self, tag: str) -> SessionProfiler | None:
+        """Create a profiler for a new session if the session is sampled.
+
+        Args:
+            tag (str): The prefix of the output file names
+
+        Returns:
+            SessionProfiler | None: The profiler, or None if the session should not be profiled
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        return SessionProfiler(self.profile_dir, tag, self.cpu, self.memory,
+                               self.sample_interval)
@@ -0,0 +1,220 @@
+import json
+import time
+import heapq
+import itertools
+import fnmatch
+import threading
+from pathlib import Path
+from utils import replace_atomically
+
+
+class OutboundQueue:
+    """A scheduler of spool files waiting to be delivered, shared by delivery workers.
+
+    Due files are handed out by priority (a smaller number goes first), files deferred after
+    a transient failure wait in a second heap ordered by their next attempt time, and the
+    delay doubles with every failed attempt. The priority of a file comes from the first
+    priority rule whose file name pattern matches it, 0 without a match.
+    """
+    entries: dict
+    ready: list
+    deferred: list
+    in_flight: set
+    failed: set
+    base_delay: float
+    max_delay: float
+    max_attempts: int
+    priority_rules: list
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 60.0, max_attempts: int = 5,
+                 priority_rules: list | None = None):
+        """Initialise an empty queue.
+
+        Args:
+            base_delay (float, optional): Seconds before the first retry. Defaults to 1.0.
+            max_delay (float, optional): The longest seconds between two retries.
+            Defaults to 60.0.
+            max_attempts (int, optional): Attempts before a file is given up. Defaults to 5.
+            priority_rules (list | None, optional): (file name pattern, priority) pairs, see
+            read_priority_rules. Defaults to None.
+        """
+        self.entries = {}   # file name -> [priority, next attempt time, failed attempts]
+        self.ready = []
+        self.deferred = []
+        self.in_flight = set()
+        self.failed = set()
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.priority_rules = priority_rules or []
+        self.sequence = itertools.count()   # keeps the order of equal entries stable
+        self.changed = threading.Condition()
+
+    def priority_of(self, file_name: str) -> int:
+        """Get the priority of a fresh spool file from the priority rules.
+
+        Args:
+            file_name (str): The spool file name
+
+        Returns:
+            int: The priority of the first matching rule, or 0
+        """
+        for pattern, priority in self.priority_rules:
+            if fnmatch.fnmatchcase(file_name, pattern):
+                return priority
+        return 0
+
+    def add(self, file_name: str, priority: int | None = None, next_attempt: float = 0.0,
+            attempts: int = 0):
+        """Queue a spool file unless it is queued already.
+
+        Args:
+            file_name (str): The spool file name
+            priority (int | None, optional): Smaller numbers are delivered first.
+            Defaults to None, which applies the priority rules.
+            next_attempt (float, optional): The earliest time to deliver it. Defaults to 0.0.
+            attempts (int, optional): Failed attempts so far. Defaults to 0.
+        """
+        with self.changed:
+            if file_name in self.entries:
+                return
+            if priority is None:
+                priority = self.priority_of(file_name)
+            self.entries[file_name] = [priority, next_attempt, attempts]
+            self.schedule(file_name)
+            self.changed.notify()
+
+    def schedule(self, file_name: str):
+        """Push an entry into the heap it belongs to. The caller must hold the condition.
+
+        Args:
+            file_name (str): The spool file name
+        """
+        priority, next_attempt, _ = self.entries[file_name]
+        if next_attempt <= time.time():
+            heapq.heappush(self.ready, (priority, next(self.sequence), file_name))
+        else:
+            heapq.heappush(self.deferred, (next_attempt, next(self.sequence), file_name))
+
+    def take(self) -> str | None:
+        """Wait for the most urgent due spool file and hand it out.
+
+        Returns:
+            str | None: The spool file name, or None when nothing is left to deliver
+        """
+        with self.changed:
+            while True:
+                now = time.time()
+                while len(self.deferred) > 0 and self.deferred[0][0] <= now:
+                    _, _, file_name = heapq.heappop(self.deferred)
+                    if file_name in self.entries:
+                        priority = self.entries[file_name][0]
+                        heapq.heappush(self.ready, (priority, next(self.sequence), file_name))
+                while len(self.ready) > 0:
+                    _, _, file_name = heapq.heappop(self.ready)
+                    if file_name in self.entries:   # removed entries stay in the heap
+                        self.in_flight.add(file_name)
+                        return file_name
+                if len(self.deferred) == 0 and len(self.in_flight) == 0:
+                    return None
+                # wake up for the next deferred file, or when another worker defers one
+                self.changed.wait(self.deferred[0][0] - now if len(self.deferred) > 0 else None)
+
+    def done(self, file_name: str):
+        """Remove a spool file which needs no more attempts, whether it is handed out or not.
+
+        Args:
+            file_name (str): The spool file name
+        """
+        with self.changed:
+            self.in_flight.discard(file_name)
+            self.entries.pop(file_name, None)
+            self.changed.notify_all()
+
+    def defer(self, file_name: str) -> bool:
+        """Schedule a retry after a transient failure, with exponential backoff.
+           Every failed attempt lowers the priority of the file by one.
+
+        Args:
+            file_name (str): The spool file name
+
+        Returns:
+            bool: True for a retry is scheduled, False for the file is given up
+        """
+        with self.changed:
+            self.in_flight.discard(file_name)
+            entry = self.entries[file_name]
+            entry[2] += 1
+            if entry[2] >= self.max_attempts:
+                self.entries.pop(file_name)
+                self.failed.add(file_name)
+                self.changed.notify_all()
+                return False
+            entry[0] += 1
+            entry[1] = time.time() + min(self.max_delay, self.base_delay * 2 ** (entry[2] - 1))
+            self.schedule(file_name)
+            self.changed.notify_all()
+            return True
+
+    def save(self, state_path: str, spool_mtime: int):
+        """Persist the queued entries so that a restart does not rescan an unchanged spool.
+           Files which are given up are saved too, so that the next run retries them.
+
+        Args:
+            state_path (str): The queue state file path
+            spool_mtime (int): The modification time of the spool directory in nanoseconds
+        """
+        with self.changed:
+            state = {"spool_mtime": spool_mtime, "entries": self.entries,
+                     "failed": sorted(self.failed)}
+            state_data = json.dumps(state)
+        replace_atomically(state_path, state_data)
+
+    def load(self, state_path: str, spool_mtime: int) -> bool:
+        """Restore the persisted entries if the spool directory is unchanged since they were saved.
+
+        Args:
+            state_path (str): The queue state file path
+            spool_mtime (int): The current modification time of the spool directory
+            in nanoseconds
+
+        Returns:
+            bool: True for the entries are restored, False for the spool must be rescanned
+        """
+        if not Path(state_path).is_file():
+            return False
+        try:
+            with open(state_path, mode="r", encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except ValueError:
+            return False
+        # given-up files need a rescan, which queues them again with fresh attempts
+        if state.get("spool_mtime") != spool_mtime or len(state.get("failed", [])) > 0:
+            return False
+        for file_name, (priority, next_attempt, attempts) in state["entries"].items():
+            self.add(file_name, priority, next_attempt, attempts)
+        return True
+
+
+def read_priority_rules(rules_text: str) -> list:
+    """Parse priority rules such as "urgent-*:-1,bulk-*:10".
+
+    Args:
+        rules_text (str): Comma separated rules, each a file name pattern and a priority
+        joined by the last colon
+
+    Raises:
+        ValueError: A rule is not of the form pattern:priority
+
+    Returns:
+        list: (file name pattern, priority) pairs, in order
+    """
+    rules = []
+    for rule in rules_text.split(","):
+        if rule.strip() == "":
+            continue
+        pattern, _, priority = rule.strip().rpartition(":")
+        if pattern == "":
+            raise ValueError(f"bad priority rule: {rule}")
+        rules.append((pattern, int(priority)))
+    return rules
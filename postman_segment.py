@@ -0,0 +1,316 @@
+import os
+import mmap
+import struct
+import threading
+from pathlib import Path
+from postman_transaction import Transaction
+from utils import file_locked, replace_atomically
+
+# generation of the index, changed by every compaction which replaces index.dat
+INDEX_HEADER = struct.Struct("=Q")
+# message ID, segment number, offset in the segment, name length, message length, record kind
+INDEX_RECORD = struct.Struct("=QIQHIB")
+MESSAGE, TOMBSTONE = 0, 1
+
+
+class SegmentMailbox:
+    """An append-only mailbox which keeps many emails in a few rolling segment files.
+
+    Every email is appended to the current segment as its name followed by its text, and
+    index.dat gets a fixed-size record locating it under a message ID which never changes.
+    index.dat starts with a generation number, so that a replaced index is told apart from
+    the old one even when the file system hands out the same inode again.
+    Deleting appends a tombstone record carrying the deleted message ID, and compaction rewrites
+    the live emails into fresh segments. The index is kept in memory and only the records
+    appended since the last look are read.
+    """
+    mailbox_path: Path
+    max_segment_size: int
+    hashes_body: bool = False
+    locations: dict
+    next_id: int
+    garbage: int
+
+    def __init__(self, mailbox_path: str, max_segment_size: int = 64 * 1024 * 1024):
+        """Open a segment mailbox, creating its directory when it does not exist.
+
+        Args:
+            mailbox_path (str): The mailbox directory
+            max_segment_size (int, optional): A segment is not appended to once it reaches
+            this size in bytes. Defaults to 64 MiB.
+        """
+        self.mailbox_path = Path(mailbox_path)
+        self.mailbox_path.mkdir(parents=True, exist_ok=True)
+        self.max_segment_size = max_segment_size
+        self.index_path = self.mailbox_path / "index.dat"
+        self.locations = {}   # message ID -> (segment, offset, name length, message length)
+        self.next_id = 0
+        self.garbage = 0      # records of deleted emails and their tombstones
+        self.generation = None
+        self.index_read = 0   # bytes of the index already in memory
+        self.index_lock = threading.Lock()
+        self.compactor = None
+        self.compacting = threading.Event()
+
+    def locked(self):
+        """Hold the mailbox-wide lock, which excludes other threads and processes.
+        """
+        return file_locked(self.mailbox_path / ".lock")
+
+    def segment_path(self, segment: int) -> Path:
+        """Get the path of a segment file.
+
+        Args:
+            segment (int): The segment number
+
+        Returns:
+            Path: The segment path
+        """
+        return self.mailbox_path / f"{segment:08d}.seg"
+
+    def last_segment(self) -> int:
+        """Get the number of the newest segment.
+
+        Returns:
+            int: The segment number, 0 if there is no segment yet
+        """
+        segments = [int(path.stem) for path in self.mailbox_path.glob("*.seg")
+                    if path.stem.isdigit()]
+        return max(segments, default=0)
+
+    def reset_index(self, generation: int | None):
+        """Forget the in-memory index, so that the next refresh reads index.dat from the start.
+           The caller must hold the index lock.
+
+        Args:
+            generation (int | None): The generation of index.dat, None if there is none
+        """
+        self.locations, self.next_id, self.garbage = {}, 0, 0
+        self.generation = generation
+        self.index_read = INDEX_HEADER.size
+
+    def refresh_index(self):
+        """Bring the in-memory index up to date with index.dat. Only the records appended since
+           the last refresh are read, unless compaction has replaced the index.
+        """
+        with self.index_lock:
+            try:
+                index_file = open(self.index_path, mode="rb")
+            except FileNotFoundError:
+                self.reset_index(None)
+                return
+            with index_file:
+                index_header = index_file.read(INDEX_HEADER.size)
+                if len(index_header) < INDEX_HEADER.size:   # still being created
+                    self.reset_index(None)
+                    return
+                generation, = INDEX_HEADER.unpack(index_header)
+                if generation != self.generation:
+                    self.reset_index(generation)
+                # a torn record at the end is left for later
+                new_size = (os.fstat(index_file.fileno()).st_size - self.index_read) \
+                    // INDEX_RECORD.size * INDEX_RECORD.size
+                if new_size <= 0:
+                    return
+                index_file.seek(self.index_read)
+                index_data = index_file.read(new_size)
+            for message_id, segment, offset, name_len, length, kind in \
+                    INDEX_RECORD.iter_unpack(index_data):
+                if kind == TOMBSTONE:
+                    self.garbage += 2 if self.locations.pop(message_id, None) is not None else 1
+                else:
+                    self.locations[message_id] = (segment, offset, name_len, length)
+                self.next_id = max(self.next_id, message_id + 1)
+            self.index_read += len(index_data)
+
+    def append_record(self, *record):
+        """Durably append a record to the index, creating the index if there is none yet.
+           The caller must hold the lock.
+
+        Args:
+            *record (int): The fields of INDEX_RECORD
+        """
+        with open(self.index_path, mode="ab") as index_file:
+            if index_file.tell() < INDEX_HEADER.size:   # a new index, or its header is torn
+                index_file.truncate(0)
+                index_file.write(INDEX_HEADER.pack(0))
+            torn_size = (index_file.tell() - INDEX_HEADER.size) % INDEX_RECORD.size
+            if torn_size > 0:   # a record torn by a crash would misalign every later one
+                index_file.truncate(index_file.tell() - torn_size)
+            index_file.write(INDEX_RECORD.pack(*record))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+    def append(self, name: str, message: bytes) -> int:
+        """Durably append an email to the mailbox.
+
+        Args:
+            name (str): The name of the email, i.e. its file name in a one-file-per-email inbox
+            message (bytes): The whole email
+
+        Returns:
+            int: The message ID
+        """
+        name_bytes = name.encode("ascii")
+        with self.locked():
+            self.refresh_index()   # other processes may have appended
+            segment = self.last_segment()
+            segment_path = self.segment_path(segment)
+            offset = segment_path.stat().st_size if segment_path.exists() else 0
+            if offset > 0 and offset + len(name_bytes) + len(message) > self.max_segment_size:
+                segment, offset = segment + 1, 0
+                segment_path = self.segment_path(segment)
+            with open(segment_path, mode="ab") as segment_file:
+                segment_file.write(name_bytes + message)
+                segment_file.flush()
+                os.fsync(segment_file.fileno())
+            message_id = self.next_id
+            self.append_record(message_id, segment, offset, len(name_bytes), len(message),
+                               MESSAGE)
+            self.refresh_index()
+        return message_id
+
+    def save_durably(self, txn: Transaction, save_folder: str, file_prefix: str = ""):
+        """Save a transaction as an email of the mailbox.
+
+        Args:
+            txn (Transaction): The transaction to save
+            save_folder (str): The inbox path, unused since the mailbox has its own directory
+            file_prefix (str, optional): The prefix of the email name. Defaults to "".
+        """
+        self.append(txn.file_name(file_prefix),
+                    txn.render_headers().encode("ascii") + txn.render_body())
+
+    def delete(self, message_id: int) -> bool:
+        """Delete an email by appending a tombstone for it.
+
+        Args:
+            message_id (int): The message ID
+
+        Returns:
+            bool: True for the email is deleted, False for there is no such email
+        """
+        with self.locked():
+            self.refresh_index()
+            if message_id not in self.locations:
+                return False
+            self.append_record(message_id, 0, 0, 0, 0, TOMBSTONE)
+            self.refresh_index()
+        return True
+
+    def messages(self):
+        """Iterate over the live emails in the order of their IDs, mapping every segment into
+           memory once.
+
+        Yields:
+            tuple[int, str, bytes]: The message ID, the email name and the whole email
+        """
+        self.refresh_index()
+        with self.index_lock:
+            locations = sorted(self.locations.items())
+        mapped = {}
+        try:
+            for message_id, (segment, offset, name_len, length) in locations:
+                if segment not in mapped:
+                    with open(self.segment_path(segment), mode="rb") as segment_file:
+                        mapped[segment] = mmap.mmap(segment_file.fileno(), 0,
+                                                    access=mmap.ACCESS_READ)
+                segment_map = mapped[segment]
+                yield message_id, segment_map[offset:offset + name_len].decode("ascii"), \
+                    segment_map[offset + name_len:offset + name_len + length]
+        finally:
+            for segment_map in mapped.values():
+                segment_map.close()
+
+    def read(self, message_id: int) -> tuple[str, bytes] | None:
+        """Read one email by its message ID.
+
+        Args:
+            message_id (int): The message ID
+
+        Returns:
+            tuple[str, bytes] | None: The email name and the whole email,
+            or None if there is no such email
+        """
+        for _ in range(2):   # a compaction in between moves the email to another segment
+            self.refresh_index()
+            with self.index_lock:
+                location = self.locations.get(message_id)
+            if location is None:
+                return None
+            segment, offset, name_len, length = location
+            try:
+                with open(self.segment_path(segment), mode="rb") as segment_file:
+                    data = os.pread(segment_file.fileno(), name_len + length, offset)
+                return data[0:name_len].decode("ascii"), data[name_len:]
+            except FileNotFoundError:
+                continue
+        return None
+
+    def compact(self, min_garbage_ratio: float = 0.0) -> bool:
+        """Rewrite the live emails into fresh segments and drop the old segments.
+           Message IDs are kept.
+
+        Args:
+            min_garbage_ratio (float, optional): Only compact when at least this share of the
+            index records are deleted emails or tombstones. Defaults to 0.0.
+
+        Returns:
+            bool: True for the mailbox was compacted
+        """
+        with self.locked():
+            self.refresh_index()
+            records_count = (self.index_read - INDEX_HEADER.size) // INDEX_RECORD.size
+            if self.garbage == 0 or self.garbage / records_count < min_garbage_ratio:
+                return False
+            old_segments = [int(path.stem) for path in self.mailbox_path.glob("*.seg")
+                            if path.stem.isdigit()]
+            segment, offset = max(old_segments, default=0) + 1, 0
+            new_records = []
+            segment_file = open(self.segment_path(segment), mode="wb")
+            for message_id, name, message in self.messages():
+                name_bytes = name.encode("ascii")
+                if offset > 0 and offset + len(name_bytes) + len(message) > self.max_segment_size:
+                    segment_file.flush()
+                    os.fsync(segment_file.fileno())
+                    segment_file.close()
+                    segment, offset = segment + 1, 0
+                    segment_file = open(self.segment_path(segment), mode="wb")
+                segment_file.write(name_bytes + message)
+                new_records.append(INDEX_RECORD.pack(message_id, segment, offset,
+                                                     len(name_bytes), len(message), MESSAGE))
+                offset += len(name_bytes) + len(message)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+            segment_file.close()
+            if self.next_id - 1 not in self.locations:
+                # the tombstone of the newest email keeps its ID from being handed out again
+                new_records.append(INDEX_RECORD.pack(self.next_id - 1, 0, 0, 0, 0, TOMBSTONE))
+            replace_atomically(self.index_path,
+                               INDEX_HEADER.pack(self.generation + 1) + b"".join(new_records))
+            for old_segment in old_segments:
+                self.segment_path(old_segment).unlink(missing_ok=True)
+            self.refresh_index()
+        return True
+
+    def start_compactor(self, interval: float = 60.0, min_garbage_ratio: float = 0.5):
+        """Compact the mailbox in a background thread from time to time.
+
+        Args:
+            interval (float, optional): Seconds between two checks. Defaults to 60.0.
+            min_garbage_ratio (float, optional): See compact. Defaults to 0.5.
+        """
+        def compact_periodically():
+            while not self.compacting.wait(interval):
+                self.compact(min_garbage_ratio)
+
+        self.compactor = threading.Thread(target=compact_periodically, daemon=True)
+        self.compactor.start()
+
+    def stop_compactor(self):
+        """Stop the background compaction.
+        """
+        if self.compactor is not None:
+            self.compacting.set()
+            self.compactor.join()
+            self.compactor = None
@@ -2,14 +2,21 @@
 import socket
 from secrets import token_hex
 import hmac
+from contextlib import nullcontext
 from typing import TYPE_CHECKING
-import regex
+import re
 from postman_states import PostmanStates
 from utils import server_log, is_smtp_message, client_log, decode_base64_msg, \
     check_email_addr, encode_base64_msg
 from postman_transaction import Transaction
 if TYPE_CHECKING:
     from postman_client import PostmanClient
+    from postman_capture import CaptureWriter
+    from postman_profiler import SessionProfiler
+    from postman_admission import AdmissionControl
+    from postman_storage import DurableStore
+    from postman_segment import SegmentMailbox
+    from postman_dedup import ContentStore
 
 class PostmanServer:
     """A SMTP Server that uses CRAM-MD5 as the authentication protocol.
@@ -27,11 +34,19 @@ class PostmanServer:
     inbox_dir_path: str
     txn: Transaction | None
     in_header: bool
+    chunks: bytearray
+    max_message_size: int
+    pending: bytes
     evil_mode: bool
     agent: "PostmanClient"
     my_msgs: list
     peer_msgs: list
     instant_logging: bool
+    capture: "CaptureWriter | None"
+    profiler: "SessionProfiler | None"
+    admission: "AdmissionControl | None"
+    peer_ip: str
+    storage: "DurableStore | ContentStore | SegmentMailbox | None"
 
     def __init__(self, inbox_dir_path: str, agent = None, instant_logging: bool = False):
         """Initialize a Postman server.
@@ -45,6 +60,9 @@ class PostmanServer:
         """
         self.inbox_dir_path = inbox_dir_path
         self.txn = None
+        self.chunks = bytearray()
+        self.max_message_size = 64 * 1024 * 1024
+        self.pending = b""
         self.my_msgs = []
         self.peer_msgs = []
         self.client_quit = False
@@ -54,6 +72,10 @@ class PostmanServer:
         else:
             self.evil_mode = False
         self.instant_logging = instant_logging
+        self.capture = None
+        self.profiler = None
+        self.admission = None
+        self.storage = None
 
     def set_credential(self, uid: str, secret: str):
         """Set the credential for this server.
@@ -75,6 +97,62 @@ class PostmanServer:
         self.pid = pid
         self.order = order
 
+    def set_capture(self, capture: "CaptureWriter"):
+        """Record all lines of the session into a capture for replaying later.
+
+        Args:
+            capture (CaptureWriter): The capture writer
+        """
+        self.capture = capture
+
+    def set_storage(self, storage: "DurableStore | ContentStore | SegmentMailbox"):
+        """Save the received emails through a storage instead of one file per email.
+
+        Args:
+            storage (DurableStore | ContentStore | SegmentMailbox): The durable store,
+            the deduplicating content store or the segment mailbox
+        """
+        self.storage = storage
+
+    def set_max_message_size(self, max_message_size: int):
+        """Limit the size of an email sent in BDAT chunks.
+
+        Args:
+            max_message_size (int): The most bytes of all chunks of an email
+        """
+        self.max_message_size = max_message_size
+
+    def set_admission(self, admission: "AdmissionControl", peer_ip: str):
+        """Rate limit the commands and messages of the client.
+
+        Args:
+            admission (AdmissionControl): The admission control shared by all sessions
+            peer_ip (str): The IPv4 address of the client
+        """
+        self.admission = admission
+        self.peer_ip = peer_ip
+
+    def set_profiler(self, profiler: "SessionProfiler"):
+        """Profile the memory usage of transactions in this session.
+
+        Args:
+            profiler (SessionProfiler): The session profiler
+        """
+        self.profiler = profiler
+
+    def trace_memory(self, label: str):
+        """Get a context manager tracing the memory usage of a code block if profiled.
+
+        Args:
+            label (str): The name of the code block
+
+        Returns:
+            ContextManager: The context manager
+        """
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.trace_memory(label)
+
     @property
     def prefix(self) -> str:
         """Get the prefix of logging lines.
@@ -94,6 +172,8 @@ class PostmanServer:
             They will be joined by carriage returns before sent.
         """
         self.conn.sendall(("\r\n".join(message)+"\r\n").encode("ascii"))
+        if self.capture is not None:
+            self.capture.record("S", "\r\n".join(message))
         if self.instant_logging:
             server_log("\r\n".join(message), prefix=self.prefix)
         else:
@@ -116,13 +196,23 @@ class PostmanServer:
             try:
                 if self.client_quit:
                     break
+                # bytes which arrived after the last chunk come first
+                client_data, self.pending = self.pending, b""
+                if b"\n" not in client_data:
+                    client_data += self.conn.recv(2048)
+                if client_data[0:5].upper() == b"BDAT " \
+                and self.current_state != PostmanStates.START_MAIL_INPUT:
+                    self.receive_chunk(client_data)
+                    continue
                 # auto replace all \n with \r\n to make the server compatible with netcat
-                client_msg = self.conn.recv(2048).decode("ascii")
+                client_msg = client_data.decode("ascii")
                 client_msg = client_msg.replace("\r\n", "\n")
                 client_msg = client_msg.replace("\n", "\r\n")
                 if is_smtp_message(client_msg):
                     # remove ONE carriage return at the end of message
                     client_msg = client_msg[0:-2]
+                    if self.capture is not None:
+                        self.capture.record("C", client_msg)
                     if self.evil_mode:   # AS
                         self.agent.request(client_msg)
                     if self.instant_logging:
@@ -130,7 +220,11 @@ class PostmanServer:
                     else:
                         self.peer_msgs.append(client_msg)
                     cur_state = self.current_state
-                    if cur_state == PostmanStates.SERVER_BASE64_ENCODED_CHALLENGE:
+                    if self.admission is not None and cur_state != PostmanStates.START_MAIL_INPUT \
+                    and not self.admission.allow_command(self.peer_ip):
+                        # 421 too many commands from the client
+                        self.transit(PostmanStates.SERVICE_NOT_AVAILABLE)
+                    elif cur_state == PostmanStates.SERVER_BASE64_ENCODED_CHALLENGE:
                         # authentication process
                         # dealing with client's uid + challenge
                         if not self.evil_mode:
@@ -156,9 +250,7 @@ class PostmanServer:
                                 "In start mail input mode BUT txn is None")
                         # input mail data
                         if client_msg == ".":  # ending an email transaction
-                            if self.txn.check_formation():
-                                self.txn.save_as(self.inbox_dir_path, self.prefix)
-                            self.transit(PostmanStates.REQUEST_MAIL_ACTION_OKAY)
+                            self.end_transaction()
                         else:  # appending an email transaction
                             self.in_header = self.txn.add_entry(client_msg, self.in_header)
                             self.transit(PostmanStates.START_MAIL_INPUT)
@@ -172,6 +264,90 @@ class PostmanServer:
             except AssertionError as err:
                 self.transit(err.args[0])
 
+    def receive_chunk(self, client_data: bytes):
+        """Receive a BDAT command with its chunk. The chunk is binary and copied as it is,
+           without being split into lines.
+
+        Args:
+            client_data (bytes): The data received so far, starting with the BDAT command
+
+        Raises:
+            ConnectionResetError: Connection is reset by the client
+        """
+        while b"\n" not in client_data:
+            more_data = self.conn.recv(2048)
+            if len(more_data) == 0:
+                raise ConnectionResetError("server")
+            client_data += more_data
+        cmd_end = client_data.index(b"\n")
+        client_msg = client_data[0:cmd_end].decode("ascii").rstrip("\r")
+        if self.capture is not None:
+            self.capture.record("C", client_msg)
+        if self.instant_logging:
+            client_log(client_msg, prefix=self.prefix)
+        else:
+            self.peer_msgs.append(client_msg)
+        args = client_msg[5:].split()
+        # 501 the chunk size, optionally followed by LAST
+        assert 1 <= len(args) <= 2 and args[0].isdigit() and args[1:] in ([], ["LAST"]), \
+            PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
+        chunk_size, last = int(args[0]), len(args) == 2
+        # whatever follows the chunk belongs to the next command
+        self.pending = client_data[cmd_end + 1 + chunk_size:]
+        if chunk_size > self.max_message_size - len(self.chunks):
+            # 552 the email is too large, and the session ends since the client is already
+            # sending a chunk which may never be worth reading to get back in step
+            self.chunks = bytearray()
+            self.txn = None
+            self.transit(PostmanStates.EXCEEDED_STORAGE_ALLOCATION)
+            self.conn.close()
+            self.client_quit = True
+            return
+        # the buffer grows with the data actually received, not with the size announced
+        chunk = bytearray(client_data[cmd_end + 1:cmd_end + 1 + chunk_size])
+        while len(chunk) < chunk_size:
+            more_data = self.conn.recv(min(chunk_size - len(chunk), 65536))
+            if len(more_data) == 0:
+                raise ConnectionResetError("server")
+            chunk += more_data
+        if self.capture is not None:
+            self.capture.record_chunk(bytes(chunk))
+        if self.evil_mode:   # AS
+            self.agent.send_chunk(bytes(chunk), last)
+        if self.admission is not None and not self.admission.allow_command(self.peer_ip):
+            # 421 too many commands from the client
+            self.transit(PostmanStates.SERVICE_NOT_AVAILABLE)
+            return
+        # 503 txn object exists, the chunk is discarded
+        assert self.txn is not None, PostmanStates.BAD_SEQUENCE_OF_COMMANDS
+        self.chunks += chunk
+        if last:
+            message, self.chunks = self.chunks, bytearray()
+            try:
+                self.txn.read_raw_message(message)
+            except SyntaxError:
+                # 501 a header line of the email is malformed
+                raise AssertionError(PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS)
+            self.end_transaction()
+        else:
+            self.transit(PostmanStates.REQUEST_MAIL_ACTION_OKAY, octets=chunk_size)
+
+    def end_transaction(self):
+        """End the current email transaction and save the email if it is well formed.
+        """
+        if self.admission is not None and not self.admission.allow_message(self.peer_ip):
+            # 421 too many messages from the client
+            self.transit(PostmanStates.SERVICE_NOT_AVAILABLE)
+            return
+        if self.txn.check_formation():
+            with self.trace_memory("save_as"):
+                if self.storage is not None:
+                    # 250 is only sent once the email is on the disk
+                    self.storage.save_durably(self.txn, self.inbox_dir_path, self.prefix)
+                else:
+                    self.txn.save_as(self.inbox_dir_path, self.prefix)
+        self.transit(PostmanStates.REQUEST_MAIL_ACTION_OKAY)
+
     def run_command(self, cmd: str, arg_str: str):
         """Run a command line from the client.
 
@@ -183,8 +359,8 @@ class PostmanServer:
         if cmd == "EHLO":
             # guardians
             # must have one IPv4 address as the only parameter
-            ipv4_regex = regex.compile(r"[0-9]{1,3}(\.[0-9]{1,3}){3}")
-            assert len(args) == 1 and ipv4_regex.match(
+            ipv4_re = re.compile(r"[0-9]{1,3}(\.[0-9]{1,3}){3}")
+            assert len(args) == 1 and ipv4_re.match(
                 args[0]) is not None, PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
             # main job
             self.client_hostname = args[0]
@@ -214,15 +390,19 @@ class PostmanServer:
             assert len(
                 args) == 1, PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
             # 501 command grammar
-            re_match = regex.compile(r"FROM:<(.+)>").match(args[0])
+            re_match = re.compile(r"FROM:<(.+)>").match(args[0])
             assert re_match is not None, PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
             # 501 email address
-            email_addr = re_match.captures(1)[0]
+            email_addr = re_match.group(1)
             assert check_email_addr(
                 email_addr), PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
             # main job
             self.in_header = True
-            self.txn = Transaction()
+            self.chunks = bytearray()
+            with self.trace_memory("Transaction"):
+                self.txn = Transaction()
+            if self.storage is not None and self.storage.hashes_body:
+                self.txn.track_body_digest()
             self.txn.sender = email_addr
             self.transit(PostmanStates.REQUEST_MAIL_ACTION_OKAY)
         elif cmd == "RCPT":
@@ -232,10 +412,10 @@ class PostmanServer:
             # 501 exactly one argument
             assert len(
                 args) == 1, PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
-            re_match = regex.compile(r"TO:<(.+)>").match(args[0])
+            re_match = re.compile(r"TO:<(.+)>").match(args[0])
             # 501 command grammar
             assert re_match is not None, PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
-            email_addr = re_match.captures(1)[0]
+            email_addr = re_match.group(1)
             # 501 email address
             assert check_email_addr(
                 email_addr), PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
@@ -246,6 +426,8 @@ class PostmanServer:
             # guardians
             # 503 txn object exists
             assert self.txn is not None, PostmanStates.BAD_SEQUENCE_OF_COMMANDS
+            # 503 DATA cannot follow BDAT chunks
+            assert len(self.chunks) == 0, PostmanStates.BAD_SEQUENCE_OF_COMMANDS
             # 501 exactly no argument
             assert len(
                 arg_str) == 0, PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
@@ -258,6 +440,7 @@ class PostmanServer:
                 arg_str) == 0, PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS
             # main job
             self.txn = None
+            self.chunks = bytearray()
             self.transit(PostmanStates.REQUEST_MAIL_ACTION_OKAY)
         elif cmd == "NOOP":
             # guardians
@@ -280,8 +463,11 @@ class PostmanServer:
             self.respond("220 Service ready")
         elif new_st == PostmanStates.REQUEST_MAIL_ACTION_OKAY:
             if args.get("ehlo") is True:
-                self.respond("250 127.0.0.1",
-                             "250 AUTH CRAM-MD5")
+                self.respond("250-127.0.0.1",
+                             "250-AUTH CRAM-MD5",
+                             "250 CHUNKING")
+            elif args.get("octets") is not None:
+                self.respond(f"250 {args['octets']} octets received")
             else:
                 self.respond("250 Requested mail action okay completed")
         elif new_st == PostmanStates.SERVICE_CLOSING_TRANSIMISSION_CHANNEL:
@@ -290,6 +476,10 @@ class PostmanServer:
                 self.agent.receive()   # receive "221 Service closing transmission channel"
             self.conn.close()
             self.client_quit = True
+        elif new_st == PostmanStates.SERVICE_NOT_AVAILABLE:
+            self.respond("421 Service not available, closing transmission channel")
+            self.conn.close()
+            self.client_quit = True
         elif new_st == PostmanStates.SERVER_BASE64_ENCODED_CHALLENGE:
             # generate a challenge for the client
             # this backdoor is permitted by Michael as per the Ed post #1818 for E2E testing
@@ -312,6 +502,8 @@ class PostmanServer:
             self.respond("504 Command parameter not implemented")
         elif new_st == PostmanStates.SYNTAX_ERROR_IN_PARAMETERS_OR_ARUGUMENTS:
             self.respond("501 Syntax error in parameters or arguments")
+        elif new_st == PostmanStates.EXCEEDED_STORAGE_ALLOCATION:
+            self.respond("552 Requested mail action aborted: exceeded storage allocation")
         elif new_st == PostmanStates.START_MAIL_INPUT:
             self.respond("354 Start mail input end <CRLF>.<CRLF>")
 
@@ -16,3 +16,4 @@ class PostmanStates(Enum):
     BAD_SEQUENCE_OF_COMMANDS = "503"
     COMMAND_PARAMETER_NOT_IMPLEMENTED = "504"
     AUTHENTICATION_CREDENTIALS_INVALID = "535"
+    EXCEEDED_STORAGE_ALLOCATION = "552"
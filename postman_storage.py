@@ -0,0 +1,134 @@
+import time
+import os
+from typing import Callable
+from postman_transaction import Transaction
+from postman_dedup import ContentStore
+from postman_segment import SegmentMailbox
+
+
+def save_transaction(txn: Transaction, save_folder: str, file_prefix: str = ""):
+    """The default storage backend: one durable file per transaction.
+
+    Args:
+        txn (Transaction): The transaction to save
+        save_folder (str): The inbox path
+        file_prefix (str, optional): The prefix of the filename. Defaults to "".
+    """
+    txn.save_as(save_folder, file_prefix, durable=True)
+
+
+class DurableStore:
+    """Saves every transaction inline with a single buffered write and an fsync, and keeps
+    statistics about the writes.
+
+    The session sends its 250 reply only once the email is on the disk. Sessions never run
+    concurrently within a process, the single-process server serves them one after another
+    and every multiprocess child serves one, so handing the write to another thread would
+    only add a handoff without overlapping any protocol work.
+    """
+    save: Callable
+    hashes_body: bool
+    saved_count: int
+    write_time: float
+
+    def __init__(self, save=save_transaction, hashes_body: bool = False):
+        """Initialise the store.
+
+        Args:
+            save (Callable, optional): The storage backend, called as
+            save(txn, save_folder, file_prefix). Defaults to save_transaction.
+            hashes_body (bool, optional): Whether the backend needs the body digest of the
+            transactions. Defaults to False.
+        """
+        self.save = save
+        self.hashes_body = hashes_body
+        self.saved_count = 0
+        self.write_time = 0.0
+
+    def save_durably(self, txn: Transaction, save_folder: str, file_prefix: str = ""):
+        """Save a transaction and return once it is durably saved.
+
+        Args:
+            txn (Transaction): The transaction to save
+            save_folder (str): The inbox path
+            file_prefix (str, optional): The prefix of the filename. Defaults to "".
+        """
+        started_at = time.monotonic()
+        self.save(txn, save_folder, file_prefix)
+        self.write_time += time.monotonic() - started_at
+        self.saved_count += 1
+
+    def metrics(self) -> dict:
+        """Get the statistics of the saved transactions.
+
+        Returns:
+            dict: The number of saved transactions, the total and mean seconds spent
+            writing them
+        """
+        return {"saved": self.saved_count, "write_time": self.write_time,
+                "mean_write_time": self.write_time / max(self.saved_count, 1)}
+
+    def summary(self) -> str:
+        """Describe the statistics of the saved transactions in a log line.
+
+        Returns:
+            str: The summary
+        """
+        metrics = self.metrics()
+        return f"Saved {metrics['saved']} emails, " \
+               f"mean write time {metrics['mean_write_time'] * 1000:.3f}ms"
+
+
+def read_segment_config(cfg: dict) -> SegmentMailbox | None:
+    """Open the segment mailbox described by a server configuration.
+
+    Args:
+        cfg (dict): The server configuration
+
+    Returns:
+        SegmentMailbox | None: The mailbox, or None if the segment backend is not selected
+    """
+    if cfg.get("storage_backend") != "segment":
+        return None
+    default_mailbox_path = os.path.join(cfg.get("inbox_path", "."), ".segments")
+    return SegmentMailbox(os.path.expanduser(cfg.get("segment_path", default_mailbox_path)),
+                          int(cfg.get("segment_max_size", str(64 * 1024 * 1024))))
+
+
+def start_segment_compactor(cfg: dict) -> SegmentMailbox | None:
+    """Compact the segment mailbox in the background if the configuration asks for it.
+       Only the long-running listener should call it.
+
+    Args:
+        cfg (dict): The server configuration
+
+    Returns:
+        SegmentMailbox | None: The mailbox being compacted, or None
+    """
+    mailbox = read_segment_config(cfg)
+    if mailbox is None or "segment_compact_interval" not in cfg:
+        return None
+    mailbox.start_compactor(float(cfg["segment_compact_interval"]),
+                            float(cfg.get("segment_compact_ratio", "0.5")))
+    return mailbox
+
+
+def read_storage_config(cfg: dict) -> "DurableStore | ContentStore | SegmentMailbox | None":
+    """Create the storage described by a server configuration.
+
+    Args:
+        cfg (dict): The server configuration
+
+    Returns:
+        DurableStore | ContentStore | SegmentMailbox | None: The storage, or None if every
+        transaction is saved as one file without waiting for the disk
+    """
+    backend = read_segment_config(cfg)
+    if cfg.get("storage_backend") == "dedup":
+        default_store_path = os.path.join(cfg.get("inbox_path", "."), ".bodies")
+        backend = ContentStore(os.path.expanduser(cfg.get("dedup_path", default_store_path)))
+    if cfg.get("durable_storage", "0") != "1":
+        return backend
+    if backend is None:
+        return DurableStore()
+    return DurableStore(backend.save_durably, backend.hashes_body)
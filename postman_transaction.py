@@ -1,8 +1,10 @@
 
+import os
+import hashlib
 from pathlib import Path
 import datetime
 import time
-import regex
+import re
 from utils import parse_rfc5322_time
 
 class Transaction:
@@ -14,10 +16,30 @@ class Transaction:
     created_time_rfc5322: str
     subject: str
     content: list[str]
+    body_hasher: "hashlib._Hash | None"
+    raw_body: bytes | None
 
     def __init__(self):
         self.recipients = []
         self.content = []
+        self.body_hasher = None
+        self.raw_body = None
+
+    def track_body_digest(self):
+        """Hash the content lines as they are added, so that the body digest is ready
+           as soon as the transaction ends.
+        """
+        self.body_hasher = hashlib.sha256(self.render_body())
+
+    def body_digest(self) -> str:
+        """Get the SHA-256 digest of the rendered body.
+
+        Returns:
+            str: The hex digest
+        """
+        if self.body_hasher is not None:
+            return self.body_hasher.hexdigest()
+        return hashlib.sha256(self.render_body()).hexdigest()
 
     def check_formation(self):
         """Check if the sender and recipient fields both exist.
@@ -39,6 +61,47 @@ class Transaction:
             self.created_time = parsed
             self.created_time_rfc5322 = rfc5322
 
+    def parse_header(self, text_line: str) -> bool:
+        """Parse a line into the header fields if it is a header line.
+
+        Args:
+            text_line (str): A text line of the file
+
+        Raises:
+            SyntaxError: The line starts like a header field but is malformed
+
+        Returns:
+            bool: True for the text line satisfies one header field's formation,
+            False for not satisfied.
+        """
+        if len(text_line) > 6 and text_line.startswith("From: "):
+            re_match = re.compile(r"From: <(.+)>").match(text_line)
+            if re_match is not None:
+                self.sender = re_match.group(1)
+                return True
+            else:
+                raise SyntaxError
+        elif len(text_line) > 4 and text_line.startswith("To: "):
+            re_match = re.compile(r"To: (<(.+)>(,<(.+)>)*)").match(text_line)
+            if re_match is not None:
+                recipients_str = re_match.group(1)
+                self.recipients = [r[1:-1] for r in recipients_str.split(",")]
+                return True
+            else:
+                raise SyntaxError
+        elif len(text_line) > 6 and text_line.startswith("Date: "):
+            rfc5322 = text_line[6:]
+            self.set_created_time(rfc5322)
+            return True
+        elif len(text_line) > 8 and text_line.startswith("Subject: "):
+            re_match = re.compile(r"Subject: (.+)").match(text_line)
+            if re_match is not None:
+                self.subject = re_match.group(1)
+                return True
+            else:
+                raise SyntaxError
+        return False
+
     def add_entry(self, text_line: str, allow_header: bool) -> bool:
         """Parse a line of transaction file into the transaction object.
 
@@ -52,36 +115,39 @@ class Transaction:
             bool: True for the text line satisfies one header field's formation,
             False for not satisfied.
         """
-        if allow_header:
-            if len(text_line) > 6 and text_line.startswith("From: "):
-                re_match = regex.compile(r"From: <(.+)>").match(text_line)
-                if re_match is not None:
-                    self.sender = re_match.captures(1)[0]
-                    return True
-                else:
-                    raise SyntaxError
-            elif len(text_line) > 4 and text_line.startswith("To: "):
-                re_match = regex.compile(r"To: (<(.+)>(,<(.+)>)*)").match(text_line)
-                if re_match is not None:
-                    recipients_str = re_match.captures(1)[0]
-                    self.recipients = [r[1:-1] for r in recipients_str.split(",")]
-                    return True
-                else:
-                    raise SyntaxError
-            elif len(text_line) > 6 and text_line.startswith("Date: "):
-                rfc5322 = text_line[6:]
-                self.set_created_time(rfc5322)
-                return True
-            elif len(text_line) > 8 and text_line.startswith("Subject: "):
-                re_match = regex.compile(r"Subject: (.+)").match(text_line)
-                if re_match is not None:
-                    self.subject = re_match.captures(1)[0]
-                    return True
-                else:
-                    raise SyntaxError
+        if allow_header and self.parse_header(text_line):
+            return True
         self.content.append(text_line)
+        if self.body_hasher is not None:
+            self.body_hasher.update((text_line.strip("\r\n") + "\n").encode("ascii"))
         return False   # when content entry is started, header info is no longer accepted
 
+    def read_raw_message(self, message: bytes):
+        """Parse the header lines at the start of a raw message and keep the rest as the body
+           exactly as it was received, without splitting it into lines. The body may be binary.
+
+        Args:
+            message (bytes): The raw message, e.g. the BDAT chunks of a transaction
+
+        Raises:
+            SyntaxError: A line starts like a header field but is malformed
+        """
+        body_start = 0
+        while body_start < len(message):
+            line_end = message.find(b"\n", body_start)
+            if line_end < 0:
+                line_end = len(message)
+            try:   # only the header lines are parsed, so only they lose their carriage return
+                header_line = message[body_start:line_end].rstrip(b"\r").decode("ascii")
+            except UnicodeDecodeError:   # binary data is never a header
+                break
+            if not self.parse_header(header_line):
+                break
+            body_start = line_end + 1
+        self.raw_body = bytes(message[body_start:])
+        if self.body_hasher is not None:
+            self.body_hasher = hashlib.sha256(self.raw_body)
+
     @classmethod
     def read_text(cls, text: str) -> "Transaction":
         """Parse email transaction file data into an Transaction object
@@ -99,25 +165,69 @@ class Transaction:
             allow_header = new_txn.add_entry(content, allow_header)
         return new_txn
 
-    def save_as(self, save_folder: str, file_prefix: str = ""):
-        """Save the current transaction object as a file.
+    def file_name(self, file_prefix: str = "") -> str:
+        """Get the file name of the transaction in the inbox.
 
         Args:
-            save_folder (str): The directory to save the file. Usually it is the inbox path.
             file_prefix (str, optional): The prefix of the filename. Defaults to "".
+
+        Returns:
+            str: The file name, based on the created time if known
+        """
+        if hasattr(self, "created_time_rfc5322") and hasattr(self, "created_time"):
+            return file_prefix + str(int(time.mktime(self.created_time.timetuple()))) + ".txt"
+        return file_prefix + "unknown.txt"
+
+    def message_lines(self) -> list[str]:
+        """Get the lines a client sends as the email data.
+
+        Returns:
+            list[str]: The Date and Subject header lines if known, then the content lines
         """
-        has_time = hasattr(self, "created_time_rfc5322") and hasattr(self, "created_time")
-        if has_time:
-            file_name = file_prefix + str(int(time.mktime(self.created_time.timetuple()))) + ".txt"
-        else:
-            file_name = file_prefix + "unknown.txt"
-        inbox_file = open(str(Path(save_folder) / file_name), mode="w", encoding="ascii")
-        print(f"From: <{self.sender}>", file=inbox_file)
-        print(f"To: <{','.join(self.recipients)}>", file=inbox_file)
-        if has_time:
-            print(f"Date: {self.created_time_rfc5322}", file=inbox_file)
+        message_lines = []
+        if hasattr(self, "created_time_rfc5322"):
+            message_lines.append("Date: " + self.created_time_rfc5322)
         if hasattr(self, "subject"):
-            print(f"Subject: {self.subject}", file=inbox_file)
-        for content_line in self.content:
-            print(content_line.strip("\r\n"), file=inbox_file)
-        inbox_file.close()
+            message_lines.append("Subject: " + self.subject)
+        message_lines.extend(self.content)
+        return message_lines
+
+    def render_headers(self) -> str:
+        """Render the header lines of the transaction as they are saved.
+
+        Returns:
+            str: The header lines, each ended by a line feed
+        """
+        header_lines = [f"From: <{self.sender}>", f"To: <{','.join(self.recipients)}>"]
+        if hasattr(self, "created_time_rfc5322") and hasattr(self, "created_time"):
+            header_lines.append(f"Date: {self.created_time_rfc5322}")
+        if hasattr(self, "subject"):
+            header_lines.append(f"Subject: {self.subject}")
+        return "".join(header_line + "\n" for header_line in header_lines)
+
+    def render_body(self) -> bytes:
+        """Render the content lines of the transaction as they are saved.
+
+        Returns:
+            bytes: The content lines, each ended by a line feed, or the raw body as it is
+        """
+        if self.raw_body is not None:
+            return self.raw_body
+        return "".join(content_line.strip("\r\n") + "\n" for content_line in self.content) \
+            .encode("ascii")
+
+    def save_as(self, save_folder: str, file_prefix: str = "", durable: bool = False):
+        """Save the current transaction object as a file with a single write.
+
+        Args:
+            save_folder (str): The directory to save the file. Usually it is the inbox path.
+            file_prefix (str, optional): The prefix of the filename. Defaults to "".
+            durable (bool, optional): Whether to wait until the file is flushed to the disk.
+            Defaults to False.
+        """
+        file_path = str(Path(save_folder) / self.file_name(file_prefix))
+        with open(file_path, mode="wb") as inbox_file:
+            inbox_file.write(self.render_headers().encode("ascii") + self.render_body())
+            if durable:
+                inbox_file.flush()
+                os.fsync(inbox_file.fileno())
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import threading
+from postman_client import PostmanClient
+from postman_capture import read_capture
+from utils import read_config
+
+
+def replay_session(records: list, server_port: int, start: float, base: int, speed: float,
+                   timeout: float, stats: dict, stats_lock: threading.Lock):
+    """Replay the client side of one captured session against the target server.
+
+    Args:
+        records (list): The captured records of the session
+        server_port (int): The port of the target server
+        start (float): The monotonic time when the replay starts
+        base (int): The earliest timestamp of the whole capture in microseconds
+        speed (float): The replay speed factor
+        timeout (float): Seconds to wait for connecting or for a server reply
+        stats (dict): Shared replay statistics
+        stats_lock (threading.Lock): The lock guarding the statistics
+    """
+    def wait_until(timestamp: int):
+        delay = start + (timestamp - base) / 1000000 / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    pm_client = PostmanClient("127.0.0.1", server_port, timeout=timeout)
+    wait_until(records[0][0])
+    latencies = []
+    try:
+        pm_client.connect()
+        pm_client.receive()
+        for index, (timestamp, direction, text) in enumerate(records):
+            if direction != "C":
+                continue
+            wait_until(timestamp)
+            sent_at = time.monotonic()
+            if text[0:5].upper() == "BDAT ":
+                # the chunk follows its command, the session cannot go on without it
+                if index + 1 >= len(records) or records[index + 1][1] != "D":
+                    raise ValueError("BDAT without a captured chunk")
+                pm_client.send_chunk(records[index + 1][2], text.upper().endswith(" LAST"))
+            else:
+                pm_client.request(text)
+            latencies.append(time.monotonic() - sent_at)
+        succeeded = True
+    except Exception:   # a timeout, a lost connection or a reply the client cannot parse
+        succeeded = False
+    finally:
+        if hasattr(pm_client, "cli"):
+            pm_client.disconnect()
+    with stats_lock:
+        stats["succeeded" if succeeded else "failed"] += 1
+        stats["requests"] += len(latencies)
+        stats["latency"] += sum(latencies)
+
+
+def main():
+    if len(sys.argv) != 2:
+        exit(1)
+    cfg = read_config(sys.argv[1])
+    if "server_port" not in cfg or "capture_path" not in cfg:
+        exit(2)
+    capture_path = os.path.expanduser(cfg["capture_path"])
+    if not cfg["server_port"].isdigit() or not os.path.isfile(capture_path):
+        exit(2)
+    server_port = int(cfg["server_port"])
+    speed = float(cfg.get("replay_speed", "1"))
+    copies = int(cfg.get("replay_copies", "1"))
+    timeout = float(cfg.get("replay_timeout", "30"))
+    sessions = [records for records in read_capture(capture_path).values() if len(records) > 0]
+    # a captured CRAM-MD5 answer only fits the challenge of its own session, so it always
+    # fails with 535 when replayed
+    authenticated = [records for records in sessions
+                     if any(direction == "C" and text[0:5].upper() == "AUTH "
+                            for _, direction, text in records)]
+    sessions = [records for records in sessions if records not in authenticated]
+    if len(sessions) == 0:
+        print(f"sessions: {len(authenticated)} skipped for authentication")
+        exit(0)
+    base = min(records[0][0] for records in sessions)
+    stats = {"succeeded": 0, "failed": 0, "requests": 0, "latency": 0.0}
+    stats_lock = threading.Lock()
+    start = time.monotonic()
+    workers = [threading.Thread(target=replay_session,
+                                args=(records, server_port, start, base, speed, timeout,
+                                      stats, stats_lock))
+               for records in sessions for _ in range(copies)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+    print(f"sessions: {stats['succeeded']} succeeded, {stats['failed']} failed, "
+          f"{len(authenticated)} skipped for authentication")
+    print(f"requests: {stats['requests']} in {elapsed:.3f}s")
+    if stats["requests"] > 0:
+        print(f"mean latency: {stats['latency'] / stats['requests'] * 1000:.3f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,10 @@
 import os
 import sys
-import socket
 from utils import read_config, server_log
 from postman_server import PostmanServer
+from postman_admission import read_admission_config
+from postman_listener import read_listener_config
+from postman_storage import read_storage_config, start_segment_compactor, DurableStore
 
 # This is just a sample pair of ID and SECRET
 PERSONAL_ID = '7D444D'
@@ -17,23 +19,38 @@ def main():
     if not cfg["server_port"].isdigit() or not os.path.isdir(inbox_path):
         exit(2)
     server_port = int(cfg["server_port"])
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind(("localhost", server_port))
-    server.listen(5)
+    server = read_listener_config(cfg, server_port)
+    admission = read_admission_config(cfg)
+    storage = read_storage_config(cfg)
+    start_segment_compactor(cfg)   # the listener compacts, sessions only append
     while True:
-        pm_server = PostmanServer(inbox_path)
-        pm_server.set_credential(PERSONAL_ID, PERSONAL_SECRET)
         try:
-            conn, _ = server.accept()
-            pm_server.run(conn)
-            pm_server.print_server_log()
+            conn, (peer_ip, _) = server.accept()
+            if admission is not None and not admission.admit(peer_ip):
+                admission.reject(conn)
+                continue
+            pm_server = PostmanServer(inbox_path)
+            pm_server.set_credential(PERSONAL_ID, PERSONAL_SECRET)
+            if "max_message_size" in cfg:
+                pm_server.set_max_message_size(int(cfg["max_message_size"]))
+            if admission is not None:
+                pm_server.set_admission(admission, peer_ip)
+            if storage is not None:
+                pm_server.set_storage(storage)
+            try:
+                pm_server.run(conn)
+                pm_server.print_server_log()
+            except ConnectionResetError:
+                pm_server.print_server_log()
+                server_log("Connection lost")
+            finally:
+                if admission is not None:
+                    admission.release(peer_ip)
         except KeyboardInterrupt:
             server_log("SIGINT received, closing")
+            if isinstance(storage, DurableStore):
+                server_log(storage.summary())
             exit(0)
-        except ConnectionResetError:
-            pm_server.print_server_log()
-            server_log("Connection lost")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,60 @@
+import sys
+import time
+import subprocess
+from utils import read_config
+
+# import time budget of every entry point, in multiples of the startup time of a bare
+# interpreter ("python -c pass") so that the budgets hold on slower and faster machines alike
+STARTUP_BUDGET = {
+    "client": 4.5,
+    "server": 6.0,
+    "multiprocess_server": 6.0,
+    "eavesdropper": 6.0,
+}
+
+def measure_baseline() -> int:
+    """Measure the wall time of starting and stopping a bare interpreter.
+
+    Returns:
+        int: The startup time in microseconds
+    """
+    started_at = time.perf_counter_ns()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return (time.perf_counter_ns() - started_at) // 1000
+
+def measure_import_time(module: str) -> int:
+    """Measure the cumulative import time of a module with "-X importtime".
+
+    Args:
+        module (str): The module name
+
+    Returns:
+        int: The cumulative import time in microseconds
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    for report_line in result.stderr.splitlines():
+        fields = report_line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise ValueError(f"no import time reported for {module}")
+
+def main():
+    # "startup_budget_<module>=<multiple>" in an optional configuration overrides a budget
+    cfg = read_config(sys.argv[1]) if len(sys.argv) == 2 else {}
+    # the fastest of several runs filters out the noise of a busy machine
+    baseline = min(measure_baseline() for _ in range(5))
+    print(f"baseline: {baseline}us")
+    within_budget = True
+    for module, default_budget in STARTUP_BUDGET.items():
+        budget = float(cfg.get(f"startup_budget_{module}", str(default_budget)))
+        import_time = min(measure_import_time(module) for _ in range(5))
+        passed = import_time <= budget * baseline
+        within_budget = within_budget and passed
+        print(f"{module}: {import_time}us, {import_time / baseline:.2f}x baseline "
+              f"(budget {budget:.2f}x) {'ok' if passed else 'OVER BUDGET'}")
+    if not within_budget:
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 
+import os
 import base64
 import datetime
 import time
-import regex
+import re
+import fcntl
+from contextlib import contextmanager
 
 def decode_base64_msg(base64_message: str) -> str:
     """Decode a base64 string using ASCII
@@ -50,7 +53,7 @@ def check_email_addr(addr: str) -> bool:
     domain = rf"({sub_domain}(\.{sub_domain})+|{address_literal})"
     dot_string = rf"{atom}(\.{atom})*"
     mailbox = rf"{dot_string}@{domain}"
-    re_match = regex.compile(mailbox).match(addr)
+    re_match = re.compile(mailbox).match(addr)
     return re_match is not None
 
 def parse_rfc5322_time(rfc5322_time: str) -> datetime.datetime | None:
@@ -63,7 +66,7 @@ def parse_rfc5322_time(rfc5322_time: str) -> datetime.datetime | None:
         datetime.datetime | None: Returns a datetime object if the time string is valid,
         otherwise returns None
     """
-    re_match = regex.compile((r"(((Mon|Tue|Wed|Thu|Fri|Sat|Sun))[,]?"
+    re_match = re.compile((r"(((Mon|Tue|Wed|Thu|Fri|Sat|Sun))[,]?"
                              r"\s([0-9]{1,2}))"
                              r"\s(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)"
                              r"\s([0-9]{4})\s([0-9]{2}):([0-9]{2})(:([0-9]{2}))?"
@@ -71,7 +74,7 @@ def parse_rfc5322_time(rfc5322_time: str) -> datetime.datetime | None:
                                 .match(rfc5322_time)
     if re_match is not None:
         day, month, year, hour, minute, _, second, timezone = \
-            [re_match.captures(i)[0] for i in range(4,12)]
+            [re_match.group(i) for i in range(4,12)]
         tz_sign, tz_h, tz_m = -1 if timezone[0] == "-" else 1, \
             int(timezone[1:3]), int(timezone[3:5])
         tzinfo = datetime.timezone(tz_sign * datetime.timedelta(hours=tz_h, minutes=tz_m))
@@ -95,6 +98,36 @@ def read_config(config_path: str) -> dict:
             config_data[key] = value
     return config_data
 
+@contextmanager
+def file_locked(lock_path: str | os.PathLike):
+    """Hold an exclusive lock on a lock file, which excludes other threads and processes.
+       The lock file is created when it does not exist.
+
+    Args:
+        lock_path (str | os.PathLike): The lock file path
+    """
+    with open(lock_path, mode="a", encoding="ascii") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def replace_atomically(file_path: str | os.PathLike, data: bytes | str):
+    """Replace the content of a file atomically and durably, so that a crash leaves either
+       the old content or the new one. The data goes to a temporary file next to it first.
+
+    Args:
+        file_path (str | os.PathLike): The file path
+        data (bytes | str): The new content, text is encoded in UTF-8
+    """
+    tmp_path = str(file_path) + ".tmp"
+    with open(tmp_path, mode="wb") as tmp_file:
+        tmp_file.write(data.encode("utf-8") if isinstance(data, str) else data)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_path, file_path)
+
 def server_log(msg: str, spy: bool = False, prefix: str = ""):
     """Log a line with the server prefix
 
@@ -127,4 +160,34 @@ def is_smtp_message(msg: str):
         bool: True for the message ends with a carriage return
     """
     return len(msg) >= 2 and msg[-2] + msg[-1] == "\r\n"
-    
+
+def is_last_reply_line(reply_line: str) -> bool:
+    """Check if a reply line ends a server reply, i.e. it is not a "250-" continuation line.
+
+    Args:
+        reply_line (str): A reply line without the carriage return
+
+    Returns:
+        bool: True for the last line of a reply
+    """
+    return len(reply_line) == 3 or (len(reply_line) > 3 and reply_line[3] != "-")
+
+def parse_smtp_reply(reply: str) -> tuple[str, list] | None:
+    """Parse a complete server reply which may consist of several lines.
+
+    Args:
+        reply (str): The reply without the carriage return at the end
+
+    Returns:
+        tuple[str, list] | None: The reply code and the text of every line,
+        or None if the reply is malformed
+    """
+    code, params = None, []
+    for reply_line in reply.split("\r\n"):
+        re_match = re.compile(r"([0-7]{3})(?:[ -](.*))?").fullmatch(reply_line)
+        if re_match is None or (code is not None and re_match.group(1) != code):
+            return None
+        code = re_match.group(1)
+        if re_match.group(2) is not None:
+            params.append(re_match.group(2))
+    return code, params